@@ -0,0 +1,48 @@
+"""Benchmark of the code block extraction on synthetic pages
+   Run from the repository root : python benchmark/bench_codeblocks.py
+   The time per block should stay about the same whatever the number of blocks"""
+import os
+import sys
+import time
+import markdown
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from plsres.util import Attributes
+from plsres.extension import PLSResExtension, CodePreprocessor
+
+# Blocks without language, so that the time is not dominated by Pygments
+BLOCK = """Some text before the block, with `inline code` and a {{=value}} template.
+""" + "Some more text to make the page heavier. " * 20 + """
+
+```
+int value{index} = {index};
+printf("%d\\n", value{index});
+```
+"""
+
+def synthetic_page(blocks):
+	return "\n".join(BLOCK.format(index=index) for index in range(blocks))
+
+def benchmark(blocks, repeat=3):
+	parameters = Attributes(buildcache="cache", outformat="html")
+	extconfig = Attributes(globals={}, cache=Attributes(documents={}), quick=False)
+	extension = PLSResExtension("bench.md", Attributes(docpath="bench"), extconfig, parameters, ispage=False)
+	md = markdown.Markdown(extensions=[extension])
+	lines = synthetic_page(blocks).split("\n")
+
+	best = None
+	for _ in range(repeat):
+		md.reset()
+		extension.reset()
+		processor = CodePreprocessor(extension, md)
+		start = time.perf_counter()
+		processor.run(lines)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+if __name__ == "__main__":
+	print(f"{'blocks':>8} {'total (ms)':>12} {'per block (µs)':>16}")
+	for blocks in (10, 30, 100, 300, 1000):
+		elapsed = benchmark(blocks)
+		print(f"{blocks :>8} {elapsed * 1000 :>12.2f} {elapsed / blocks * 1e6 :>16.1f}")
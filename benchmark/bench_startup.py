@@ -0,0 +1,58 @@
+"""Benchmark of the startup of single document compilations, as the preview hooks run them
+   Run from the repository root : python benchmark/bench_startup.py
+   Prints the slowest imports of plsres.extension (python -X importtime), then the time
+   of a whole compile_plsmarkdown.py run on a small document"""
+import os
+import sys
+import time
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DOCUMENT = """# Title
+
+Some text with a {=1+1} template and a $$x^2$$ formula.
+
+```
+int a = 1;
+```
+"""
+
+def import_times(module, top=15):
+	"""Get the (cumulative µs, self µs, module) of the slowest imports of a module, in a fresh interpreter"""
+	result = subprocess.run(
+		[sys.executable, "-X", "importtime", "-c", f"import {module}"],
+		cwd=ROOT, capture_output=True, encoding="utf-8")
+	imports = []
+	for line in result.stderr.splitlines():
+		if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+			continue
+		selftime, cumulative, name = line[len("import time:"):].split("|")
+		imports.append((int(cumulative), int(selftime), name.rstrip()))
+	total = next((cumulative for cumulative, _, name in imports if name.strip() == module), None)
+	return total, sorted(imports, reverse=True)[:top]
+
+def run_time(repeat=10):
+	"""Median wall time of a single document compilation"""
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		subprocess.run([sys.executable, os.path.join(ROOT, "compile_plsmarkdown.py")],
+		               cwd=ROOT, input=DOCUMENT, capture_output=True, encoding="utf-8", check=True)
+		times.append(time.perf_counter() - start)
+	return statistics.median(times)
+
+if __name__ == "__main__":
+	total, imports = import_times("plsres.extension")
+	print(f"import plsres.extension : {total / 1000 :.1f} ms")
+	print(f"{'cumulative (ms)':>16} {'self (ms)':>10}  module")
+	for cumulative, selftime, name in imports:
+		print(f"{cumulative / 1000 :>16.1f} {selftime / 1000 :>10.1f}  {name}")
+
+	start = time.perf_counter()
+	for _ in range(10):
+		subprocess.run([sys.executable, "-c", "pass"], capture_output=True)
+	interpreter = (time.perf_counter() - start) / 10
+	print()
+	print(f"Bare interpreter : {interpreter * 1000 :.1f} ms")
+	print(f"Single document compilation : {run_time() * 1000 :.1f} ms")
@@ -1,14 +1,16 @@
 import os
 import sys
-import yaml
 import markdown
+from markdown.extensions.tables import TableExtension
 import argparse
 from plsres.util import Attributes
+from plsres.config import load_yaml, configure_cache
 from plsres.extension import PLSResExtension
+from plsres.exdb import LazyExerciseStore, store_path
+from plsres import timing
 
 def load_licenses(parameters):
-	with open(os.path.join(parameters.template, "licenses.yml"), "r", encoding="utf-8") as licensefile:
-		licenselist = yaml.load(licensefile.read(), yaml.Loader)
+	licenselist = load_yaml(os.path.join(parameters.template, "licenses.yml"))
 
 	licenses = {}
 	for item in licenselist["licenses"]:
@@ -17,13 +19,12 @@ def load_licenses(parameters):
 	return licenses
 
 def load_parameters(filename):
-	with open(filename, "r", encoding="utf-8") as paramfile:
-		return Attributes(yaml.load(paramfile.read(), yaml.Loader))
+	parameters = load_yaml(filename, attributes=True)
+	configure_cache(parameters)
+	return parameters
 
 def load_exercise_config(parameters):
-	attrpath = os.path.join(parameters.template, "exercises.yml")
-	with open(attrpath, "r", encoding="utf-8") as attrfile:
-		return Attributes(yaml.load(attrfile.read(), yaml.Loader))
+	return load_yaml(os.path.join(parameters.template, "exercises.yml"), attributes=True)
 
 def load_extconfig(parameters):
 	return Attributes(
@@ -38,21 +39,58 @@ def load_extconfig(parameters):
 		quick = False,
 		updateall = True,
 		exerciseconfig = load_exercise_config(parameters),
+		tempdir = parameters.get("temporary", "temp"),
 	)
 
 def default_document(parameters):
-	return Attributes(docpath="")
+	return Attributes(docpath="", global_exercises=LazyExerciseStore(store_path(parameters)))
 
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser()
 	parser.add_argument("--parameters", "-p", default="generate.yml")
+	parser.add_argument("--site", "-s", action="store_true", help="Compile all the pages under the source directory into the output directory, as HTML pages or JSON records according to outformat")
+	parser.add_argument("--jobs", "-j", type=int, default=None, help="Number of worker processes for --site (default : CPU count)")
+	parser.add_argument("--incremental", "-i", action="store_true", help="With --site, only compile the documents whose inputs changed since the last build")
+	parser.add_argument("--watch", "-w", action="store_true", help="Compile the site, then recompile the affected documents on every change and serve the output, the pages reload in the browser after each build")
+	parser.add_argument("--port", type=int, default=8000, help="Port of the preview server for --watch (0 to disable)")
+	parser.add_argument("--profile", action="store_true", help="Print the time spent in each document and build stage")
+	parser.add_argument("--profile-json", default=None, help="With --profile, also write the timing report to this JSON file")
+	parser.add_argument("--profile-trace", default=None, help="With --profile, also write the timings to this file in the Trace Event Format (Perfetto, speedscope)")
 	args = parser.parse_args()
 
-	input_md = sys.stdin.read()
 	parameters = load_parameters(args.parameters)
+	if args.profile or args.profile_json is not None or args.profile_trace is not None:
+		timing.enable()
+	if args.watch:
+		from plsres.build import load_cache, load_page_template  # Only needed for whole site builds, keeps single documents quick to start
+		from plsres.watch import watch_site
+		def reload_extconfig():
+			extconfig = load_extconfig(parameters)
+			extconfig.template = load_page_template(parameters)
+			extconfig.cache = load_cache(parameters)
+			return extconfig
+		report = (lambda: timing.report(args.profile_json, args.profile_trace)) if timing.enabled() else None
+		watch_site(parameters, reload_extconfig, args.jobs, args.port if args.port > 0 else None, report)
+		sys.exit(0)
+	elif args.site:
+		from plsres.build import compile_site, load_cache, load_page_template
+		extconfig = load_extconfig(parameters)
+		extconfig.template = load_page_template(parameters)
+		extconfig.cache = load_cache(parameters)
+		extconfig.updateall = not args.incremental
+		compile_site(parameters, extconfig, args.jobs)
+		if timing.enabled():
+			timing.report(args.profile_json, args.profile_trace)
+		sys.exit(0)
+
+	input_md = sys.stdin.read()
 	extension = PLSResExtension("", default_document(parameters), load_extconfig(parameters), parameters, ispage=False)
 	extension.start()
-	md = markdown.Markdown(extensions=["tables", extension])
-	html = md.convert(input_md)
+	md = markdown.Markdown(extensions=[TableExtension(), extension])
+	timing.instrument(md)
+	with timing.compiling(""):
+		html = md.convert(input_md)
 	print(html)
 	extension.finish()
+	if timing.enabled():
+		timing.report(args.profile_json, args.profile_trace)
@@ -0,0 +1,200 @@
+import os
+import re
+import hashlib
+import threading
+
+from .util import Attributes
+from .cache import content_key
+
+EXT_SVG_COMMENT_REGEX = re.compile(r"<!--.*?-->", re.DOTALL)
+EXT_SVG_METADATA_REGEX = re.compile(r"<metadata\b[^>]*?(/>|>.*?</metadata>)", re.DOTALL)
+EXT_SVG_EDITOR_ELEMENT_REGEX = re.compile(r"<(sodipodi|inkscape):([\w-]+)\b[^>]*?(/>|>.*?</\1:\2>)", re.DOTALL)
+EXT_SVG_EDITOR_ATTRIBUTE_REGEX = re.compile(r"\s+(sodipodi|inkscape|xmlns:(sodipodi|inkscape|rdf|cc|dc))(:[\w-]+)?=\"[^\"]*\"")
+EXT_SVG_TEXT_REGEX = re.compile(r"(<text\b.*?</text>)", re.DOTALL)
+EXT_SVG_BETWEEN_TAGS_REGEX = re.compile(r">\s+<")
+EXT_SVG_TAG_SPACE_REGEX = re.compile(r"<[^>]*>")
+EXT_SVG_GEOMETRY_REGEX = re.compile(r"(\s(?:d|points|transform|viewBox|x|y|x1|y1|x2|y2|cx|cy|r|rx|ry|width|height)=\")([^\"]*)(\")")
+EXT_SVG_NUMBER_REGEX = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?")  # Number grammar of the SVG attributes
+
+
+def strip_xml_header(svg):
+	"""Remove the superfluous XML header"""
+	try:
+		svg.index("<?")
+		xmlend = svg.index("?>")
+		svg = svg[xmlend + 2:]
+	except ValueError:
+		pass
+	return svg.strip()
+
+def round_number(number, precision):
+	"""Round a number to `precision` decimals, keep it as it is when that does not make it shorter"""
+	rounded = f"{float(number) :.{precision}f}".rstrip("0").rstrip(".")
+	if rounded in ("", "-0"):
+		rounded = "0"
+	return rounded if len(rounded) < len(number) else number
+
+def round_numbers(value, precision):
+	"""Round the numbers of a geometry attribute. Path data can chain numbers without separator
+	   (1.5.25 is 1.5 and .25), a space is added where the rounded numbers would merge"""
+	result = []
+	position = 0
+	for match in EXT_SVG_NUMBER_REGEX.finditer(value):
+		number = match.group(0)
+		integer = match.group(1).partition(".")[0]
+		if len(integer) < 2 or integer[0] != "0":  # Otherwise, packed arc flags (a 1 1 0 011.5 2), kept as they are
+			number = round_number(number, precision)
+		separator = value[position:match.start()]
+		if separator == "" and len(result) > 0 and EXT_SVG_NUMBER_REGEX.match(result[-1] + number).group(0) != result[-1]:
+			separator = " "
+		result.extend((separator, number))
+		position = match.end()
+	result.append(value[position:])
+	return "".join(result)
+
+def minify_svg(svg, precision=3):
+	"""Remove the comments, metadata and editor data (Inkscape, Sodipodi) from an SVG,
+	   the whitespace between the tags outside of texts, and round the coordinates to `precision` decimals"""
+	svg = EXT_SVG_COMMENT_REGEX.sub("", svg)
+	svg = EXT_SVG_METADATA_REGEX.sub("", svg)
+	svg = EXT_SVG_EDITOR_ELEMENT_REGEX.sub("", svg)
+	svg = EXT_SVG_EDITOR_ATTRIBUTE_REGEX.sub("", svg)
+	svg = EXT_SVG_GEOMETRY_REGEX.sub(lambda match: match.group(1) + round_numbers(match.group(2), precision) + match.group(3), svg)
+
+	parts = EXT_SVG_TEXT_REGEX.split(svg)
+	for index in range(0, len(parts), 2):  # Odd parts are texts, where whitespace matters
+		parts[index] = EXT_SVG_BETWEEN_TAGS_REGEX.sub("><", parts[index])
+		parts[index] = EXT_SVG_TAG_SPACE_REGEX.sub(lambda match: " ".join(match.group(0).split()).replace(" />", "/>"), parts[index])
+		if index > 0:  # Whitespace between the tags and the texts
+			parts[index] = parts[index].lstrip()
+		if index + 1 < len(parts):
+			parts[index] = parts[index].rstrip()
+	return "".join(parts).strip()
+
+
+# Path -> ((modification time, size, options), loaded SVG), shared by all the documents compiled by the process
+_svg_cache = {}
+_svg_cache_lock = threading.Lock()
+
+def load_svg(path, minify=False, precision=3):
+	"""Load an SVG to embed, return its text and the fingerprint of the file
+	   Each file is only read again when it changes. Raises UnicodeDecodeError for non-text files"""
+	stat = os.stat(path)
+	signature = (stat.st_mtime_ns, stat.st_size, minify, precision)
+	with _svg_cache_lock:
+		if path in _svg_cache and _svg_cache[path][0] == signature:
+			return _svg_cache[path][1]
+
+	with open(path, "rb") as svgfile:
+		content = svgfile.read()
+	svg = strip_xml_header(content.decode("utf-8"))
+	if minify:
+		svg = minify_svg(svg.replace("\r\n", "\n").replace("\r", "\n"), precision)
+
+	asset = Attributes(svg=svg, fingerprint=hashlib.sha256(content).hexdigest())
+	with _svg_cache_lock:
+		_svg_cache[path] = (signature, asset)
+	return asset
+
+
+# Pillow format name and MIME type of the image variants
+EXT_IMAGE_FORMATS = {
+	"avif": ("AVIF", "image/avif"),
+	"webp": ("WEBP", "image/webp"),
+	"png": ("PNG", "image/png"),
+	"jpeg": ("JPEG", "image/jpeg"),
+}
+EXT_IMAGE_SOURCES = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff")
+
+# Path -> ((modification time, size, options), image variants)
+_image_cache = {}
+_image_support = None
+
+def image_support():
+	"""Get the output formats supported by the local Pillow build, None if Pillow is not installed"""
+	global _image_support
+	if _image_support is None:
+		try:
+			from PIL import features
+			_image_support = {name for name in ("avif", "webp") if features.check(name)} | {"png", "jpeg"}
+		except ImportError:
+			_image_support = set()
+			print("WARNING : Pillow is not installed, the images are included as they are")
+	return _image_support
+
+def image_settings(parameters):
+	formats = [name for name in parameters.get("imageformats", ["avif", "webp"]) if name in image_support()]
+	return Attributes(
+		widths=sorted(parameters.get("imagewidths", [480, 960, 1920])),
+		formats=formats,
+		quality=parameters.get("imagequality", 80),
+		directory=parameters.get("imageoutput", "out/static/img/"),
+		prefix=parameters.get("imageprefix", "/static/plsres/img/"))
+
+def write_variant(image, path, outformat, quality):
+	"""Encode an image variant, atomically so that concurrent builds never serve partial files"""
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	temppath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+	pillowformat = EXT_IMAGE_FORMATS[outformat][0]
+	if outformat == "png":
+		image.save(temppath, pillowformat, optimize=True)
+	elif outformat == "jpeg":
+		image.convert("RGB").save(temppath, pillowformat, quality=quality, optimize=True, progressive=True)
+	else:
+		image.save(temppath, pillowformat, quality=quality)
+	os.replace(temppath, path)
+
+def build_image_variants(path, content, settings):
+	"""Resize and encode an image to all the configured widths and formats, return its description
+	   The variants are named after the hash of the source and of the settings, existing files are not built again"""
+	from PIL import Image
+
+	digest = hashlib.sha256(content).hexdigest()
+	key = content_key(digest, settings)[:16]
+	stem = os.path.splitext(os.path.basename(path))[0]
+	with Image.open(path) as source:  # Only reads the header, the image is decoded if some variants are missing
+		if getattr(source, "is_animated", False):
+			return None
+		width, height = source.size
+		fallback = "jpeg" if source.format == "JPEG" else "png"
+		widths = [candidate for candidate in settings.widths if candidate < width] + [width]
+
+		image = None
+		variants = {}
+		for outformat in settings.formats + [fallback]:
+			variants[outformat] = []
+			for variantwidth in widths:
+				filename = f"{stem}-{key}-{variantwidth}.{outformat}"
+				variantpath = os.path.join(settings.directory, filename)
+				if not os.path.exists(variantpath):
+					if image is None:
+						image = source if source.mode in ("RGB", "RGBA", "L", "LA") else source.convert("RGBA")
+					if variantwidth == width:
+						resized = image
+					else:
+						resized = image.resize((variantwidth, max(1, round(height * variantwidth / width))), Image.LANCZOS)
+					write_variant(resized, variantpath, outformat, settings.quality)
+				variants[outformat].append((f"{settings.prefix}/{filename}".replace("//", "/"), variantwidth))
+
+	return Attributes(width=width, height=height, fallback=fallback, variants=variants, fingerprint=digest)
+
+def load_image(path, parameters):
+	"""Get the responsive variants of an image, built once per change of the source image
+	   Return None when the image is included as it is (variants disabled, no Pillow, unsupported or animated image)"""
+	if not parameters.get("imagevariants", False) or not path.lower().endswith(EXT_IMAGE_SOURCES) or len(image_support()) == 0:
+		return None
+	settings = image_settings(parameters)
+	stat = os.stat(path)
+	signature = (stat.st_mtime_ns, stat.st_size, content_key(settings))
+	if path in _image_cache and _image_cache[path][0] == signature:
+		return _image_cache[path][1]
+
+	with open(path, "rb") as imagefile:
+		content = imagefile.read()
+	try:
+		image = build_image_variants(path, content, settings)
+	except (OSError, ValueError) as exc:
+		print(f"WARNING : Could not build the variants of {path} : {exc}")
+		image = None
+	_image_cache[path] = (signature, image)
+	return image
@@ -0,0 +1,356 @@
+import os
+import re
+import json
+import time
+import shutil
+import multiprocessing
+import markdown
+from markdown.extensions.tables import TableExtension
+
+from .util import Attributes
+from .config import load_yaml
+from .exdb import compile_store, open_store, store_path, exercise_directory, export_raw
+from .cache import ResultCache, content_key
+from .bundle import write_bundle
+from .facets import write_facets
+from .search import SearchIndex
+from .precompress import precompress_output
+from .expression import evaluate
+from .extension import PLSResExtension, EXT_META_PREFIX, EXT_META_ASSIGN_REGEX
+from .timing import enable, enabled, instrument, compiling, drain, add_events
+from .dependencies import file_fingerprint, document_fingerprint, current_fingerprint, config_fingerprint
+
+EXT_ORDER_PREFIX_REGEX = re.compile(r"^\d+--")
+EXT_SECTION_ATTRIBUTES = "attributes.yml"
+EXT_DOCUMENT_ATTRIBUTES = ("title", "subtitle", "description", "themeColor", "hidden")
+EXT_ROOT_ATTRIBUTES = {"hidden": True, "themeColor": [255, 255, 255]}  # Unless src/attributes.yml sets them
+
+
+def list_sources(parameters):
+	"""List all the markdown documents under the source directory, in a stable order"""
+	sources = []
+	for dirpath, dirnames, filenames in os.walk(parameters.source):
+		dirnames.sort()
+		for filename in sorted(filenames):
+			if filename.endswith(".md"):
+				sources.append(os.path.join(dirpath, filename))
+	return sources
+
+def document_path(parameters, filepath):
+	"""Get the docpath of a source file (info/c/stdlib/5--string.md -> info.c.stdlib.string)"""
+	relpath = os.path.splitext(os.path.relpath(filepath, parameters.source))[0]
+	return ".".join(EXT_ORDER_PREFIX_REGEX.sub("", part) for part in relpath.split(os.path.sep))
+
+def output_path(parameters, docpath):
+	"""Get the file to write the compiled page to, with the extension of the output format"""
+	return os.path.join(parameters.output, *docpath.split(".")) + (".json" if parameters.outformat == "json" else ".html")
+
+def document_meta(filepath, globals):
+	"""Evaluate the meta instructions of a document to get its attributes (title, description, ...) before compiling it"""
+	locals = {}
+	with open(filepath, "r", encoding="utf-8") as sourcefile:
+		for line in sourcefile:
+			if line.startswith(EXT_META_PREFIX) and (match := EXT_META_ASSIGN_REGEX.match(line.replace(EXT_META_PREFIX, "").rstrip("\n"))):
+				try:
+					locals[match.group(1).strip()] = evaluate(match.group(2).strip(), globals, locals)
+				except Exception:  # Reported when the document is compiled
+					pass
+	return locals
+
+def make_document(docpath, attributes, defaulttitle):
+	"""Build a document of the tree, with all the attributes the page processors read"""
+	values = {name: attributes.get(name) for name in EXT_DOCUMENT_ATTRIBUTES}
+	values["title"] = str(values["title"]) if values["title"] is not None else defaulttitle
+	return Attributes(docpath=docpath, attributes=Attributes(values), previous=None, category=None, next=None)
+
+def section_attributes(directory):
+	path = os.path.join(directory, EXT_SECTION_ATTRIBUTES)
+	return (load_yaml(path) or {}) if os.path.exists(path) else {}
+
+def load_section(parameters, extconfig, directory, section, sources):
+	"""Add the documents of a section directory to the tables, return its tree : name -> (document, subtree)
+	   The children come in the order of `sections` in its attributes.yml, then in the order of the file names.
+	   The pages of a section are linked to each other as previous and next pages"""
+	entries = {}
+	for filename in sorted(os.listdir(directory)):
+		path = os.path.normpath(os.path.join(directory, filename))
+		if os.path.isdir(path) or path in sources:
+			entries[EXT_ORDER_PREFIX_REGEX.sub("", os.path.splitext(filename)[0])] = path
+	attributes = section_attributes(directory)
+	listed = [name for name in attributes.get("sections") or [] if name in entries]
+	order = listed + [name for name in entries if name not in listed]
+
+	tree = {}
+	pages = []
+	for name in order:
+		path = entries[name]
+		if path in sources:
+			docpath = sources[path]
+			document = make_document(docpath, document_meta(path, extconfig.globals), docpath)
+			subtree = {}
+			pages.append(document)
+		else:
+			docpath = f"{section.docpath}.{name}" if section.docpath != "" else name
+			document = make_document(docpath, section_attributes(path), name)
+			subtree = load_section(parameters, extconfig, path, document, sources)
+			if len(subtree) == 0:  # No page in this directory
+				continue
+		document.category = section
+		extconfig.pathtable[docpath] = document
+		extconfig.parenttable[docpath] = section.docpath
+		extconfig.linktable[docpath] = (parameters.linkprefix + docpath.replace(".", "/") + ".html").replace("//", "/")
+		tree[name] = (document, subtree)
+
+	for previous, following in zip(pages, pages[1:]):
+		previous.next = following
+		following.previous = previous
+	return tree
+
+def load_site_tables(parameters, extconfig, tasks):
+	"""Build the document tree of the site : a section per directory, described by its attributes.yml, and the pages,
+	   described by their meta instructions. Fills the path, parent and link tables so that the pages get their
+	   navigation and theme and the internal links resolve. The tables are updated in place, the compilers keep a reference to them"""
+	for table in (extconfig.linktable, extconfig.pathtable, extconfig.parenttable, extconfig.documenttree):
+		table.clear()
+	root = make_document("", EXT_ROOT_ATTRIBUTES | section_attributes(parameters.source), "")
+	extconfig.pathtable[""] = root
+	extconfig.linktable[""] = parameters.linkprefix
+	sources = {os.path.normpath(filepath): docpath for filepath, docpath in tasks}
+	extconfig.documenttree.update(load_section(parameters, extconfig, parameters.source, root, sources))
+
+def load_page_template(parameters):
+	"""Read the HTML page template of the site (pagetemplate in the template directory), the bare page content if there is none"""
+	try:
+		with open(os.path.join(parameters.template, parameters.get("pagetemplate", "page.html")), "r", encoding="utf-8") as templatefile:
+			return templatefile.read()
+	except FileNotFoundError:
+		return "{=__content}"
+
+def remove_output(parameters, docpath):
+	"""Remove the output of a document whose source was deleted, and the directories it leaves empty"""
+	outpath = output_path(parameters, docpath)
+	try:
+		os.remove(outpath)
+	except FileNotFoundError:
+		return
+	directory = os.path.dirname(outpath)
+	while os.path.normpath(directory) != os.path.normpath(parameters.output):
+		try:
+			os.rmdir(directory)
+		except OSError:  # Not empty
+			break
+		directory = os.path.dirname(directory)
+
+
+class SiteCompiler:
+	"""Compile many pages in a single process, reusing the same Markdown pipeline
+	   The pages are compiled in the output format of the parameters, from the document tree built by load_site_tables"""
+	def __init__(self, parameters, extconfig, tempdir=None, exercises=None):
+		self.parameters = parameters
+		self.config = extconfig
+		self.exercises = exercises
+		self.tempdir = os.path.abspath(tempdir) if tempdir is not None else None
+		self.extension, self.md = self.pipeline(ispage=True)
+		self.fragmentextension = None  # Pipeline of the rendered exercise database, built on first use
+		self.fragmentmd = None
+
+	def pipeline(self, ispage):
+		extension = PLSResExtension("", Attributes(docpath=""), self.config, self.parameters, ispage=ispage)
+		if self.tempdir is not None:
+			extension.tempdir = self.tempdir
+		md = markdown.Markdown(extensions=[TableExtension(), extension])
+		instrument(md)
+		return extension, md
+
+	def compile(self, filepath, docpath):
+		"""Compile a single page, return the resulting output, the document cache entry and its search data"""
+		with open(filepath, "r", encoding="utf-8") as sourcefile:
+			source = sourcefile.read()
+
+		document = Attributes(self.config.pathtable[docpath], global_exercises=self.exercises)
+		self.extension.set_document(filepath, document)
+		self.md.reset()
+		self.extension.start()
+		self.extension.add_dependency("file", filepath, file_fingerprint(filepath))
+		self.extension.add_dependency("document", docpath, document_fingerprint(self.config, docpath))
+		try:
+			with compiling(docpath):
+				html = self.md.convert(source)
+		finally:
+			self.extension.finish()
+		return html, self.extension.doc_cache(), self.extension.searchdata
+
+	def render_exercise(self, name):
+		"""Render a single exercise out of any page, for the rendered exercise database"""
+		if self.fragmentmd is None:
+			self.fragmentextension, self.fragmentmd = self.pipeline(ispage=False)
+		self.fragmentextension.set_document(f"exercise {name}", Attributes(docpath="", global_exercises=self.exercises))
+		self.fragmentmd.reset()
+		self.fragmentextension.start()
+		try:
+			return self.fragmentmd.convert(f"{{!exercise: {name}}}")
+		finally:
+			self.fragmentextension.finish()
+			del self.config.cache.documents[""]  # Not a document of the site
+
+
+# Compiler of the current pool worker process
+_worker_compiler = None
+
+def worker_tempdir(extconfig):
+	"""Directory under which each pool worker runs its code blocks"""
+	return extconfig.get("tempdir", "temp")
+
+def init_worker(parameters, extconfig, profiling):
+	"""Build the compiler of a pool worker. The shared tables in extconfig are only read from
+	   `profiling` is passed explicitly, the workers only inherit the profiler when they are forked"""
+	global _worker_compiler
+	if profiling:
+		enable()  # Also forgets the timings inherited from the main process
+	tempdir = os.path.join(worker_tempdir(extconfig), f"worker-{os.getpid()}")
+	_worker_compiler = SiteCompiler(parameters, extconfig, tempdir, open_store(store_path(parameters)))
+
+def compile_worker(task):
+	filepath, docpath = task
+	html, doccache, searchdata = _worker_compiler.compile(filepath, docpath)
+	return html, doccache, searchdata, drain()  # The timings go back to the main process with the result
+
+
+def write_output(parameters, docpath, html):
+	outpath = output_path(parameters, docpath)
+	os.makedirs(os.path.dirname(outpath), exist_ok=True)
+	with open(outpath, "w", encoding="utf-8") as outfile:
+		outfile.write(html)
+
+def load_cache(parameters):
+	"""Load the compiler cache saved by the last build"""
+	try:
+		with open(parameters.cache, "r", encoding="utf-8") as cachefile:
+			cache = Attributes(json.load(cachefile))
+	except (OSError, ValueError):
+		cache = Attributes()
+	cache.setdefault("config", None)
+	cache.setdefault("documents", {})
+	return cache
+
+def save_cache(parameters, cache):
+	with open(parameters.cache, "w", encoding="utf-8") as cachefile:
+		json.dump(cache, cachefile)
+
+def bundle_records(parameters, docpaths):
+	"""Read back the compiled documents for the site bundle
+	   The JSON pages are bundled as they are, the HTML pages in a record with their content"""
+	for docpath in docpaths:
+		with open(output_path(parameters, docpath), "r", encoding="utf-8") as outfile:
+			if parameters.outformat == "json":
+				yield docpath, json.load(outfile)
+			else:
+				yield docpath, {"docpath": docpath, "content": outfile.read()}
+
+def export_exercises(parameters, compiler, changed, configfingerprint):
+	"""Write the exercise database exports, only rendering again the exercises that changed"""
+	store = compiler.exercises
+	if parameters.get("exdboutput") and (len(changed) > 0 or not os.path.exists(parameters.exdboutput)):
+		export_raw(parameters.exdboutput, store)
+	if parameters.get("exdbfacets") and (len(changed) > 0 or not os.path.exists(parameters.exdbfacets)):
+		write_facets(parameters.exdbfacets, store)
+
+	if parameters.get("exdbrender"):
+		renders = ResultCache(os.path.join(parameters.get("buildcache", "cache"), "exdbrender"), parameters.get("resultcachesize", 256) * 1024 * 1024)
+		rendered = {}
+		missing = 0
+		for name in store:
+			key = content_key("exdbrender", configfingerprint, store.fingerprint(name))
+			cached = renders.get(key)
+			if cached is None:
+				cached = {"html": compiler.render_exercise(name)}
+				renders.put(key, cached)
+				missing += 1
+			rendered[name] = cached["html"]
+		if missing > 0 or len(changed) > 0 or not os.path.exists(parameters.exdbrender):
+			os.makedirs(os.path.dirname(parameters.exdbrender) or ".", exist_ok=True)
+			with open(parameters.exdbrender, "w", encoding="utf-8") as exportfile:
+				json.dump(rendered, exportfile, separators=(",", ":"), ensure_ascii=False)
+
+def up_to_date(parameters, extconfig, docpath, exercises=None):
+	"""Check whether none of the inputs of a document changed since it was last compiled"""
+	entry = extconfig.cache.documents.get(docpath)
+	if entry is None or "dependencies" not in entry or not os.path.exists(output_path(parameters, docpath)):
+		return False
+	for dependency, fingerprint in entry["dependencies"].items():
+		if current_fingerprint(dependency, extconfig, exercises) != fingerprint:
+			return False
+	return True
+
+def compile_site(parameters, extconfig, jobs=None, compiler=None):
+	"""Compile the whole source tree into the output directory, with `jobs` worker processes
+	   The pages are written in the output format of the parameters : HTML pages in extconfig.template, or JSON records
+	   The documents are compiled independently and written in order, so the output does not depend on `jobs`
+	   Unless extconfig.updateall is set, only the documents whose inputs changed are compiled
+	   A SiteCompiler can be given to reuse it when compiling in this process"""
+	starttime = time.perf_counter()
+	if jobs is None:
+		jobs = os.cpu_count() or 1
+	tasks = [(filepath, document_path(parameters, filepath)) for filepath in list_sources(parameters)]
+	docpaths = [docpath for filepath, docpath in tasks]
+	total = len(tasks)
+	search = None
+	if parameters.get("searchindex"):
+		search = SearchIndex(parameters.searchindex, os.path.join(parameters.get("buildcache", "cache"), "search.json"), parameters.get("searchprefix", 2))
+
+	hasexercises = os.path.isdir(exercise_directory(parameters))
+	changedexercises = compile_store(parameters) if hasexercises else set()
+	exercises = open_store(store_path(parameters)) if hasexercises else None
+
+	load_site_tables(parameters, extconfig, tasks)
+	configfingerprint = config_fingerprint(parameters, extconfig)
+	if not extconfig.updateall and extconfig.cache.get("config") == configfingerprint:
+		tasks = [(filepath, docpath) for filepath, docpath in tasks
+		         if not up_to_date(parameters, extconfig, docpath, exercises) or (search is not None and docpath not in search)]
+
+	if compiler is None:
+		compiler = SiteCompiler(parameters, extconfig)
+	if compiler.exercises is not None:
+		compiler.exercises.close()
+	compiler.exercises = exercises  # The store may have been compiled again
+	if jobs <= 1 or len(tasks) <= 1:
+		results = (compiler.compile(filepath, docpath) for filepath, docpath in tasks)
+		for (filepath, docpath), (html, doccache, searchdata) in zip(tasks, results):
+			write_output(parameters, docpath, html)
+			if search is not None:
+				search.update(docpath, searchdata)
+	else:
+		processes = min(jobs, len(tasks))
+		workerparameters = Attributes(parameters, codejobs=parameters.get("codejobs") or max(1, (os.cpu_count() or 1) // processes))
+		with multiprocessing.Pool(processes, initializer=init_worker, initargs=(workerparameters, extconfig, enabled())) as pool:
+			results = pool.imap(compile_worker, tasks)
+			for (filepath, docpath), (html, doccache, searchdata, events) in zip(tasks, results):
+				write_output(parameters, docpath, html)
+				extconfig.cache.documents[docpath] = doccache
+				if search is not None:
+					search.update(docpath, searchdata)
+				add_events(events)
+		tempdir = worker_tempdir(extconfig)
+		for name in os.listdir(tempdir) if os.path.isdir(tempdir) else []:
+			if name.startswith("worker-"):
+				shutil.rmtree(os.path.join(tempdir, name), ignore_errors=True)
+
+	# Only recorded once every document compiled, after a failed build the skipped ones still need the new configuration
+	extconfig.cache.config = configfingerprint
+	for docpath in set(extconfig.cache.documents.keys()) - set(docpaths):
+		remove_output(parameters, docpath)
+		del extconfig.cache.documents[docpath]
+
+	if exercises is not None:
+		export_exercises(parameters, compiler, changedexercises, configfingerprint)
+	save_cache(parameters, extconfig.cache)
+	if search is not None:
+		for docpath in set(search.state["ids"].keys()) - set(docpaths):
+			search.remove(docpath)
+		search.save()
+	if parameters.get("bundle"):
+		write_bundle(parameters.bundle, bundle_records(parameters, docpaths), parameters.get("bundlecompression"))
+	if parameters.get("precompress", False):
+		precompress_output(parameters, jobs)
+	print(f"Compiled {len(tasks)}/{total} documents in {time.perf_counter() - starttime :.2f}s ({jobs} jobs)")
+	return len(tasks)
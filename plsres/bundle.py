@@ -0,0 +1,92 @@
+import os
+import gzip
+import json
+
+BUNDLE_FORMAT = 1
+
+
+def compressor(compression):
+	"""Get the function that compresses a record, None when the records are stored as they are"""
+	if compression in (None, "none", False):
+		return None
+	elif compression == "gzip":
+		return lambda data: gzip.compress(data, compresslevel=6, mtime=0)
+	elif compression == "zstd":
+		import zstandard
+		return zstandard.ZstdCompressor(level=10).compress
+	raise ValueError(f"Unknown bundle compression {compression}")
+
+def decompressor(compression):
+	if compression in (None, "none", False):
+		return None
+	elif compression == "gzip":
+		return gzip.decompress
+	elif compression == "zstd":
+		import zstandard
+		return zstandard.ZstdDecompressor().decompress
+	raise ValueError(f"Unknown bundle compression {compression}")
+
+def index_path(path):
+	return path + ".index.json"
+
+
+def write_bundle(path, documents, compression=None):
+	"""Write all the documents of the site in a single file, with an index of their offsets
+	   `documents` yields (docpath, record), each record is a JSON-serializable dict written in compact form.
+	   Uncompressed, the bundle is newline-delimited JSON ; otherwise each record is compressed on its own,
+	   so that a server can read a single document with one seek in either case"""
+	if compression == "zstd":
+		try:
+			import zstandard
+		except ImportError:
+			print("WARNING : zstandard is not installed, the bundle is compressed with gzip")
+			compression = "gzip"
+	compress = compressor(compression)
+
+	index = {}
+	os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+	temppath = f"{path}.{os.getpid()}.tmp"
+	with open(temppath, "wb") as bundlefile:
+		offset = 0
+		for docpath, record in documents:
+			data = (json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n").encode("utf-8")
+			if compress is not None:
+				data = compress(data)
+			bundlefile.write(data)
+			index[docpath] = [offset, len(data)]
+			offset += len(data)
+	with open(index_path(temppath), "w", encoding="utf-8") as indexfile:
+		json.dump({"format": BUNDLE_FORMAT, "compression": compression or "none", "documents": index}, indexfile, separators=(",", ":"), ensure_ascii=False)
+
+	# Servers must reload the index along with the bundle
+	os.replace(temppath, path)
+	os.replace(index_path(temppath), index_path(path))
+	return index
+
+
+class BundleReader:
+	"""Read single documents from a bundle written by write_bundle"""
+	def __init__(self, path):
+		self.path = path
+		with open(index_path(path), "r", encoding="utf-8") as indexfile:
+			index = json.load(indexfile)
+		if index.get("format") != BUNDLE_FORMAT:
+			raise ValueError(f"Unsupported bundle format {index.get('format')} in {path}")
+		self.documents = index["documents"]
+		self.decompress = decompressor(index["compression"])
+		self.file = open(path, "rb")
+
+	def raw(self, docpath):
+		"""Get the stored bytes of a document as they are, to send them with the matching Content-Encoding"""
+		offset, length = self.documents[docpath]
+		return os.pread(self.file.fileno(), length, offset)
+
+	def get(self, docpath):
+		"""Get the record of a document, KeyError if it is not in the bundle"""
+		data = self.raw(docpath)
+		if self.decompress is not None:
+			data = self.decompress(data)
+		return json.loads(data)
+
+	def close(self):
+		self.file.close()
@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import threading
+
+
+def content_key(*items):
+	"""Hash a set of JSON-serializable values into a cache key"""
+	serialized = json.dumps(items, ensure_ascii=False, default=str)
+	return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class FileStore:
+	"""Persistent content-addressed store, with one file per entry
+	   The modification time of an entry is refreshed on every hit, so that the least
+	   recently used entries are evicted first when the store grows above `maxsize` bytes"""
+	suffix = ""
+
+	def __init__(self, directory, maxsize):
+		self.directory = directory
+		self.maxsize = maxsize
+		self.size = None  # Total size of the entries, computed on the first write
+
+	def entrypath(self, key):
+		return os.path.join(self.directory, key[:2], key + self.suffix)
+
+	def touch(self, path):
+		"""Mark an entry as used, return False if it does not exist"""
+		try:
+			os.utime(path)
+			return True
+		except OSError:
+			return False
+
+	def added(self, path):
+		"""Account for a new entry, and evict the oldest ones if needed"""
+		if self.size is None:
+			self.size = sum(size for _, size, _ in self.entries())
+		else:
+			self.size += os.path.getsize(path)
+		if self.size > self.maxsize:
+			self.evict()
+
+	def entries(self):
+		"""List the (path, size, last use time) of all the entries"""
+		entries = []
+		if not os.path.exists(self.directory):
+			return entries
+		for subdir in os.scandir(self.directory):
+			if subdir.is_dir():
+				for entry in os.scandir(subdir.path):
+					if entry.name.endswith(self.suffix) and not entry.name.endswith(".tmp"):
+						stat = entry.stat()
+						entries.append((entry.path, stat.st_size, stat.st_mtime))
+		return entries
+
+	def evict(self):
+		"""Remove the least recently used entries until the store fits in 3/4 of its maximum size"""
+		entries = sorted(self.entries(), key=lambda entry: entry[2])
+		self.size = sum(size for _, size, _ in entries)
+		target = self.maxsize * 3 // 4
+		for path, size, _ in entries:
+			if self.size <= target:
+				break
+			try:
+				os.remove(path)
+			except FileNotFoundError:  # Already evicted by another process
+				pass
+			self.size -= size
+
+
+class ResultCache (FileStore):
+	"""Persistent cache of code block results, addressed by the hash of everything that determines them"""
+	suffix = ".json"
+
+	def get(self, key):
+		"""Get the value for a key, or None if it is not in the cache"""
+		path = self.entrypath(key)
+		try:
+			with open(path, "r", encoding="utf-8") as entryfile:
+				value = json.load(entryfile)
+		except (OSError, ValueError):
+			return None
+		self.touch(path)
+		return value
+
+	def put(self, key, value):
+		"""Write a value in the cache"""
+		path = self.entrypath(key)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		temppath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+		with open(temppath, "w", encoding="utf-8") as entryfile:
+			json.dump(value, entryfile, ensure_ascii=False)
+		os.replace(temppath, path)  # Atomic, concurrent builds never see partial entries
+		self.added(path)
+
+
+class BinaryStore (FileStore):
+	"""Persistent store of compiled programs, addressed by the hash of their source and compiler options"""
+	def get(self, key, destination):
+		"""Put a copy of the stored file at `destination`, return False if it is not in the store"""
+		path = self.entrypath(key)
+		import shutil
+		if not self.touch(path):
+			return False
+		try:
+			os.link(path, destination)
+		except OSError:
+			try:
+				shutil.copy2(path, destination)
+			except OSError:
+				return False
+		return True
+
+	def put(self, key, source):
+		"""Store a copy of the file at `source`"""
+		import shutil
+		path = self.entrypath(key)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		temppath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+		shutil.copy2(source, temppath)
+		os.replace(temppath, path)
+		self.added(path)
@@ -0,0 +1,124 @@
+import os
+import re
+import sys
+import pickle
+import hashlib
+import threading
+
+from .util import Attributes
+from .cache import FileStore, content_key
+
+
+class YAMLError (ValueError):
+	"""A YAML document could not be parsed"""
+	pass
+
+
+def parse_yaml(text):
+	"""Parse a YAML document with the fastest available loader
+	   PyYAML is only imported when a document has to be parsed, the cached ones are unpickled"""
+	import yaml
+	loader = getattr(yaml, "CLoader", yaml.Loader)  # The libyaml loader is much faster, it builds the same objects
+	try:
+		return yaml.load(text, loader)
+	except yaml.YAMLError as exc:
+		raise YAMLError(str(exc)) from exc
+
+
+class ObjectCache (FileStore):
+	"""Persistent cache of parsed YAML files, as pickles"""
+	suffix = ".pickle"
+
+	def get(self, key):
+		path = self.entrypath(key)
+		try:
+			with open(path, "rb") as entryfile:
+				data = entryfile.read()
+		except OSError:
+			return None
+		self.touch(path)
+		return data
+
+	def put(self, key, data):
+		path = self.entrypath(key)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		temppath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+		with open(temppath, "wb") as entryfile:
+			entryfile.write(data)
+		os.replace(temppath, path)
+		self.added(path)
+
+
+# Path -> ((modification time, size), pickled value), and the persistent cache behind it
+# The persistent cache is created on first use in the user cache directory, unless configure_cache put it in the build cache before
+_yaml_memory = {}
+_yaml_store = None
+_yaml_lock = threading.Lock()
+
+def configure_cache(parameters):
+	"""Put the persistent cache in the build cache directory of the parameters"""
+	global _yaml_store
+	_yaml_store = ObjectCache(
+		os.path.join(parameters.get("buildcache", "cache"), "yaml"),
+		parameters.get("yamlcachesize", 64) * 1024 * 1024)
+
+_yaml_version = None
+
+def yaml_version():
+	"""Version of PyYAML, part of the cache keys. Read from the source of the package, so that it is not imported"""
+	global _yaml_version
+	if _yaml_version is None:
+		if "yaml" in sys.modules:
+			_yaml_version = sys.modules["yaml"].__version__
+		else:
+			import importlib.util
+			with open(importlib.util.find_spec("yaml").origin, "r", encoding="utf-8") as sourcefile:
+				match = re.search(r"^__version__\s*=\s*['\"](.+?)['\"]", sourcefile.read(), re.MULTILINE)
+			if match is None:
+				import yaml
+				_yaml_version = yaml.__version__
+			else:
+				_yaml_version = match.group(1)
+	return _yaml_version
+
+def user_cache_directory():
+	"""Cache directory of the user, for the tools that load YAML files without the site parameters"""
+	base = os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+	return os.path.join(base, "plsres")
+
+def yaml_store():
+	global _yaml_store
+	with _yaml_lock:
+		if _yaml_store is None:
+			_yaml_store = ObjectCache(os.path.join(user_cache_directory(), "yaml"), 64 * 1024 * 1024)
+		return _yaml_store
+
+def load_yaml(path, attributes=False):
+	"""Load a YAML file, a file is only parsed again when its content changes
+	   Each call returns a new object, so that the callers can modify it. With `attributes`, a mapping
+	   at the top level is returned as Attributes"""
+	stat = os.stat(path)
+	signature = (stat.st_mtime_ns, stat.st_size)
+	with _yaml_lock:
+		cached = _yaml_memory.get(path)
+	if cached is not None and cached[0] == signature:
+		data = cached[1]
+	else:
+		with open(path, "rb") as yamlfile:
+			content = yamlfile.read()
+		key = content_key("yaml", yaml_version(), os.path.abspath(path), hashlib.sha256(content).hexdigest())
+		store = yaml_store()
+		data = store.get(key)
+		try:
+			if data is None:
+				data = pickle.dumps(parse_yaml(content.decode("utf-8")), pickle.HIGHEST_PROTOCOL)
+				store.put(key, data)
+		except OSError:  # Read-only build cache, only keep it in memory
+			pass
+		with _yaml_lock:
+			_yaml_memory[path] = (signature, data)
+
+	value = pickle.loads(data)
+	if attributes and isinstance(value, dict):
+		return Attributes(value)
+	return value
@@ -0,0 +1,83 @@
+import os
+import glob
+import hashlib
+
+from .cache import content_key
+
+# Collection files whose content is shown in the listings, only the names of the others matter
+EXT_COLLECTION_CONFIG = ("attributes.yml", "licensing.yml")
+
+
+def file_fingerprint(path):
+	"""Hash of the content of a file, None if it does not exist"""
+	try:
+		with open(path, "rb") as f:
+			return hashlib.sha256(f.read()).hexdigest()
+	except OSError:
+		return None
+
+def collection_fingerprint(path):
+	"""Hash of what a collection listing is built from : the file tree and its YAML files"""
+	if not os.path.isdir(path):
+		return None
+	items = []
+	for dirpath, dirnames, filenames in os.walk(path):
+		dirnames.sort()
+		for filename in sorted(filenames):
+			filepath = os.path.join(dirpath, filename)
+			if filename in EXT_COLLECTION_CONFIG:
+				items.append((os.path.relpath(filepath, path), file_fingerprint(filepath)))
+			else:
+				items.append((os.path.relpath(filepath, path), None))
+		items.extend((os.path.relpath(os.path.join(dirpath, dirname), path), "dir") for dirname in dirnames)
+	return content_key(items)
+
+def exercise_fingerprint(exercises, name):
+	if exercises is None or name not in exercises:
+		return None
+	if hasattr(exercises, "fingerprint"):  # Compiled store, see plsres.exdb
+		return exercises.fingerprint(name)
+	return content_key(exercises[name])
+
+def link_fingerprint(extconfig, docpath):
+	"""Hash of what a document shows from another one : its link and its title"""
+	if docpath not in extconfig.linktable:
+		return None
+	return content_key(extconfig.linktable[docpath], extconfig.pathtable[docpath].attributes.title)
+
+def document_fingerprint(extconfig, docpath):
+	"""Hash of what a page shows from the document tree : its attributes, its neighbours and its sections"""
+	document = extconfig.pathtable.get(docpath)
+	if document is None:
+		return None
+	neighbours = [(other.docpath, other.attributes) if other is not None else None
+	              for other in (document.previous, document.category, document.next)]
+	parents = []
+	while docpath != "":
+		docpath = extconfig.parenttable[docpath]
+		parents.append((docpath, extconfig.pathtable[docpath].attributes))
+	return content_key(document.attributes, neighbours, parents)
+
+def current_fingerprint(dependency, extconfig, exercises):
+	"""Compute the current fingerprint of a dependency recorded by PLSResExtension.add_dependency"""
+	kind, _, name = dependency.partition(":")
+	if kind == "file":
+		return file_fingerprint(name)
+	elif kind == "collection":
+		return collection_fingerprint(name)
+	elif kind == "exercise":
+		return exercise_fingerprint(exercises, name)
+	elif kind == "link":
+		return link_fingerprint(extconfig, name)
+	elif kind == "document":
+		return document_fingerprint(extconfig, name)
+	raise ValueError(f"Unknown dependency kind {kind}")
+
+def config_fingerprint(parameters, extconfig):
+	"""Hash of everything all documents depend on : compiler, parameters, templates and site globals"""
+	files = sorted(glob.glob(os.path.join(parameters.template, "*")))
+	files += sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py")))
+	return content_key(
+		[(os.path.basename(path), file_fingerprint(path)) for path in files],
+		parameters, extconfig.template,
+		{name: value for name, value in extconfig.globals.items() if name != "__builtins__"})
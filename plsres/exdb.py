@@ -0,0 +1,212 @@
+import os
+import json
+import mmap
+import struct
+import hashlib
+import collections.abc
+
+from .util import Attributes
+from .config import parse_yaml, YAMLError
+
+EXDB_MAGIC = b"PLSEXDB2"
+EXDB_HEADER = struct.Struct("<8sQ")  # Magic, length of the index
+EXDB_SOURCES = (".yml", ".yaml")
+
+# Keys used to render the exercises, and their type when it matters
+EXDB_EXERCISE_SCHEMA = {"title": str, "questions": list}
+EXDB_QUESTION_SCHEMA = {"difficulty": int, "type": str, "text": None, "hints": list, "answer": None}
+EXDB_CHOICE_SCHEMA = {"text": None, "answer": None}
+EXDB_HINT_SCHEMA = {"level": int, "text": None}
+
+
+def exercise_sources(directory):
+	"""List the exercise files, exercise name -> path. The name is the path in the exercise directory,
+	   without the extension and with dots as separators (algo/sort/bubble.yml -> algo.sort.bubble)"""
+	sources = {}
+	for dirpath, dirnames, filenames in os.walk(directory):
+		dirnames.sort()
+		for filename in sorted(filenames):
+			if filename.endswith(EXDB_SOURCES):
+				path = os.path.join(dirpath, filename)
+				relpath = os.path.splitext(os.path.relpath(path, directory))[0]
+				sources[".".join(relpath.split(os.path.sep))] = path
+	return sources
+
+def check_keys(value, schema, location):
+	if not isinstance(value, dict):
+		raise ValueError(f"{location or 'the exercise'} must be a mapping")
+	for key, keytype in schema.items():
+		if key not in value:
+			raise ValueError(f"missing key {location}{key}")
+		if keytype is not None and (not isinstance(value[key], keytype) or isinstance(value[key], bool)):
+			raise ValueError(f"{location}{key} must be of type {keytype.__name__}, not {type(value[key]).__name__}")
+
+def check_exercise(exercise):
+	"""Check that an exercise has everything it needs to be rendered, raises ValueError otherwise"""
+	check_keys(exercise, EXDB_EXERCISE_SCHEMA, "")
+	for i, question in enumerate(exercise["questions"]):
+		check_keys(question, EXDB_QUESTION_SCHEMA, f"questions[{i}].")
+		if question["type"] == "choices":
+			if not isinstance(question.get("choices"), list):
+				raise ValueError(f"questions[{i}].choices must be a list of choices")
+			for j, choice in enumerate(question["choices"]):
+				check_keys(choice, EXDB_CHOICE_SCHEMA, f"questions[{i}].choices[{j}].")
+		for j, hint in enumerate(question["hints"]):
+			check_keys(hint, EXDB_HINT_SCHEMA, f"questions[{i}].hints[{j}].")
+
+def exercise_directory(parameters):
+	return os.path.join(parameters.resources, parameters.get("exercises", "exercises/"))
+
+def store_path(parameters):
+	return parameters.get("exercisestore", os.path.join(parameters.get("buildcache", "cache"), "exercises.db"))
+
+
+class ExerciseStore (collections.abc.Mapping):
+	"""Read-only mapping of the exercises in a compiled store, exercise name -> exercise
+	   Only the index is read when opening the store, each exercise is parsed on first access"""
+	def __init__(self, path):
+		self.path = path
+		with open(path, "rb") as storefile:
+			self.map = mmap.mmap(storefile.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, indexlength = EXDB_HEADER.unpack_from(self.map, 0)
+		if magic != EXDB_MAGIC:
+			raise ValueError(f"{path} is not an exercise store")
+		self.index = json.loads(self.map[EXDB_HEADER.size : EXDB_HEADER.size + indexlength])
+		self.start = EXDB_HEADER.size + indexlength
+		self.loaded = {}
+
+	def raw(self, name):
+		"""Get the JSON record of an exercise as it is stored"""
+		offset, length = self.index[name]["record"]
+		return self.map[self.start + offset : self.start + offset + length]
+
+	def __getitem__(self, name):
+		if name not in self.loaded:
+			self.loaded[name] = json.loads(self.raw(name), object_hook=Attributes)
+		return self.loaded[name]
+
+	def __contains__(self, name):
+		return name in self.index
+
+	def __iter__(self):
+		return iter(self.index)
+
+	def __len__(self):
+		return len(self.index)
+
+	def fingerprint(self, name):
+		"""Hash of the source of an exercise, None if it does not exist"""
+		entry = self.index.get(name)
+		return entry["hash"] if entry is not None else None
+
+	def close(self):
+		self.map.close()
+
+
+def open_store(path):
+	"""Open a compiled exercise store, None if it does not exist or cannot be read"""
+	try:
+		return ExerciseStore(path)
+	except (OSError, ValueError):
+		return None
+
+def compile_store(parameters):
+	"""Compile the exercise directory into the indexed store, return the names of the exercises that changed
+	   Only the sources whose modification time or size changed are read, and only those whose content
+	   changed are parsed again, the records of the others are copied from the previous store"""
+	directory = exercise_directory(parameters)
+	path = store_path(parameters)
+	previous = open_store(path)
+	sources = exercise_sources(directory) if os.path.isdir(directory) else {}
+
+	index = {}
+	records = []
+	changed = set()
+	offset = 0
+	for name, sourcepath in sources.items():
+		stat = os.stat(sourcepath)
+		entry = previous.index.get(name) if previous is not None else None
+		if entry is not None and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+			digest, record = entry["hash"], previous.raw(name)
+		else:
+			with open(sourcepath, "rb") as sourcefile:
+				content = sourcefile.read()
+			digest = hashlib.sha256(content).hexdigest()
+			if entry is not None and entry["hash"] == digest:
+				record = previous.raw(name)
+			else:
+				try:
+					exercise = parse_yaml(content.decode("utf-8"))
+					check_exercise(exercise)
+				except (YAMLError, UnicodeDecodeError, ValueError) as exc:
+					print(f"ERROR : Exercise {name} ({sourcepath}) could not be loaded : {exc}")
+					continue
+				record = json.dumps(exercise, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+				changed.add(name)
+		index[name] = {"record": [offset, len(record)], "hash": digest, "mtime": stat.st_mtime_ns, "size": stat.st_size}
+		records.append(record)
+		offset += len(record)
+	if previous is not None:
+		changed |= previous.index.keys() - index.keys()
+
+	if previous is None or len(changed) > 0 or index != previous.index:
+		indexdata = json.dumps(index, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+		os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+		temppath = f"{path}.{os.getpid()}.tmp"
+		with open(temppath, "wb") as storefile:
+			storefile.write(EXDB_HEADER.pack(EXDB_MAGIC, len(indexdata)))
+			storefile.write(indexdata)
+			for record in records:
+				storefile.write(record)
+		if previous is not None:
+			previous.close()
+		os.replace(temppath, path)
+	elif previous is not None:
+		previous.close()
+	return changed
+
+def export_raw(path, store):
+	"""Write all the exercises as a single JSON object, from their stored records"""
+	os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+	with open(path, "wb") as exportfile:
+		exportfile.write(b"{")
+		for i, name in enumerate(store):
+			if i > 0:
+				exportfile.write(b",")
+			exportfile.write(json.dumps(name, ensure_ascii=False).encode("utf-8") + b":")
+			exportfile.write(store.raw(name))
+		exportfile.write(b"}")
+
+class LazyExerciseStore (collections.abc.Mapping):
+	"""Exercise store that is only opened on first access, for the single document compilations
+	   The store is not compiled again here, that is left to the site builds"""
+	def __init__(self, path):
+		self.path = path
+		self.opened = None
+
+	@property
+	def store(self):
+		if self.opened is None:
+			self.opened = open_store(self.path)
+			if self.opened is None:
+				print(f"WARNING : No exercise store at {self.path}, compile the site with --site to build it")
+				self.opened = {}
+		return self.opened
+
+	def raw(self, name):
+		return self.store.raw(name)
+
+	def __getitem__(self, name):
+		return self.store[name]
+
+	def __contains__(self, name):
+		return name in self.store
+
+	def __iter__(self):
+		return iter(self.store)
+
+	def __len__(self):
+		return len(self.store)
+
+	def fingerprint(self, name):
+		return self.store.fingerprint(name) if name in self.store else None
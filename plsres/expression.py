@@ -0,0 +1,11 @@
+import functools
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_expression(expression):
+	"""Compile a Python expression once, the code objects are shared by all documents"""
+	return compile(expression, "<string>", "eval")
+
+def evaluate(expression, globals, locals):
+	"""Evaluate a Python expression from a template or meta instruction"""
+	return eval(compile_expression(expression), globals, locals)
@@ -1,32 +1,34 @@
 import os
 import re
-import io
 import sys
 import math
 import time
 import html
-import yaml
+import copy
 import json
-import locale
-import builtins
-import platform
-import subprocess
+import functools
 import xml.etree.ElementTree as etree
 
 import markdown
 import markdown.util
 from markdown.extensions import Extension
+from markdown.extensions.tables import TableExtension  # By class, looking up "tables" imports importlib.metadata
 from markdown.preprocessors import Preprocessor
 from markdown.blockprocessors import BlockProcessor
 from markdown.inlinepatterns import InlineProcessor
 from markdown.treeprocessors import Treeprocessor
 from markdown.postprocessors import Postprocessor, RawHtmlPostprocessor
 
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name
-from pygments.formatters import HtmlFormatter
-
 from .util import Attributes
+from .config import load_yaml
+from .cache import ResultCache, content_key
+from .runner import python_pool, c_compiler, c_compiler_version
+from .highlight import highlighter
+from .mathrender import math_renderer
+from .expression import evaluate
+from .timing import timed, instrument
+from .assets import EXT_IMAGE_FORMATS, load_svg, load_image
+from .dependencies import file_fingerprint, collection_fingerprint, exercise_fingerprint, link_fingerprint
 
 ### Extension detection patterns
 EXT_META_PREFIX = "////"
@@ -44,11 +46,15 @@ EXT_UNDERLINE_PATTERN = r"__(.*?)__"
 EXT_SVG_PATTERN = r"\{!svg[ \t]*:[ \t]*(?P<name>.*?)([ \t]*:[ \t]*(?P<alt>.*?))?\}"
 EXT_IMG_PATTERN = r"\{!img[ \t]*:[ \t]*(?P<name>.*?)([ \t]*:[ \t]*(?P<alt>.*?))?\}"
 EXT_CONTENT_ANCHOR_SEP = "////"
+EXT_SEARCH_DESCRIPTION_LENGTH = 200  # Length of the descriptions taken from the text of the documents
+EXT_TEMPLATE_SLOT_REGEX = re.compile(r"\{=([^{}]*?)\}")
+EXT_MATH_MARKER = "\x02plsres-math:{}\x03"
+EXT_MATH_MARKER_REGEX = re.compile(r"\x02plsres-math:(\d+)\x03")
 EXT_FENCE_REGEX = re.compile(r";;;[ \t]*(?P<type>[\w_-]+)?", re.MULTILINE | re.DOTALL);
 
-# Load the fence settings
-with open(os.path.join("template", "fence.yml"), "r", encoding="utf-8") as fencefile:
-	FENCE_PARAMETERS = yaml.load(fencefile.read(), yaml.Loader)
+def fence_parameters(parameters):
+	"""Get the fence settings from the template directory, cached by load_yaml until the file changes"""
+	return load_yaml(os.path.join(parameters.get("template", "template/"), "fence.yml"))
 
 
 class PLSResExtension (Extension):
@@ -69,10 +75,23 @@ class PLSResExtension (Extension):
 		# extconfig["parenttable"]   # Table docpath -> parent document
 		# extconfig["cache"]         # Compiler cache
 		# extconfig["quick"]         # Whether to generate quickly (reuse cached results, ...)
+		# extconfig["tempdir"]       # Directory for the temporary files (code block sandboxes, ...)
 		self.currentid = 0           # Unique id value within the document
 		self.currentcode = 0         # Current code block ID
-		self.keptfiles = {}
+		self.keptfiles = {}          # Kept file name -> number of following code blocks that still need it
+		self.keptsources = {}        # Kept file name -> content
 		self.ispage = ispage
+		self.fragmentrenderers = []  # Idle Markdown instances for the document fragments
+		self.expressionglobals = None
+		self.dependencies = {}       # Inputs of the document -> fingerprint, for incremental builds
+		self.tempdir = os.path.abspath(extconfig.get("tempdir", "temp"))  # Directory where the code blocks are run, absolute so that no working directory change can move it
+		self.resultcache = ResultCache(
+			os.path.join(parameters.get("buildcache", "cache"), "results"),
+			parameters.get("resultcachesize", 256) * 1024 * 1024)
+		self.mathrenderer = math_renderer(parameters)
+		self.infragment = False     # Set while building the Markdown instances of the fragments
+		self.searchdata = None      # Content to index for the search, see plsres.search
+		self.formulas = []          # (LaTeX, display mode) of the formulas to render, for the whole document and its fragments
 
 	def extendMarkdown(self, md):
 		md.preprocessors.register(MetaPreprocessor(self, md), "plsres_preprocess_variable", 1001)
@@ -90,6 +109,10 @@ class PLSResExtension (Extension):
 		md.inlinePatterns.register(DeleteProcessor(self, md), "plsres_inline_delete", 189)
 		md.inlinePatterns.register(UnderlineProcessor(self, md), "plsres_inline_underline", 188)
 		md.treeprocessors.register(StyleProcessor(self, md), "plsres_tree_style", 1000)
+		if self.parameters.get("searchindex") and not self.infragment:  # After the contents tree set the anchors
+			md.treeprocessors.register(SearchTreeProcessor(self, md), "plsres_tree_search", -10)
+		if self.mathrenderer is not None and not self.infragment:  # After the raw HTML and the fragments are put back into the document
+			md.postprocessors.register(MathPostprocessor(self, md), "plsres_postprocess_math", 20)
 		if self.ispage:
 			md.treeprocessors.register(ContentTreeProcessor(self, md), "plsres_tree_content", 0)
 			if self.parameters.outformat == "html":
@@ -97,6 +120,61 @@ class PLSResExtension (Extension):
 			else:
 				md.postprocessors.register(JSONPostProcessor(self, md), "plsres_postprocess_page", 0)
 
+	def set_document(self, path, document):
+		"""Point the extension to another document, so that the same Markdown instance can be reused"""
+		self.path = path
+		self.document = document
+		self.reset()
+
+	def reset(self):
+		"""Reset the per-document state"""
+		self.locals.clear()  # Cleared in place, the processors keep a reference to it
+		self.currentid = 0
+		self.currentcode = 0
+		self.keptfiles = {}
+		self.keptsources = {}
+		self.expressionglobals = None
+		self.dependencies = {}
+		self.searchdata = None
+		self.formulas = []
+
+	def render_fragment(self, text):
+		"""Render a fragment of the document (exercise text, ...) to HTML, without the page processors
+		   The Markdown instances are built once and reset between fragments"""
+		if len(self.fragmentrenderers) > 0:
+			md = self.fragmentrenderers.pop()
+		else:  # Also when a fragment contains other fragments
+			ispage, self.ispage = self.ispage, False
+			self.infragment = True
+			md = markdown.Markdown(extensions=[TableExtension(), self])
+			self.ispage = ispage
+			self.infragment = False
+			instrument(md)
+		try:
+			return md.convert(text)
+		finally:
+			md.reset()
+			self.fragmentrenderers.append(md)
+
+	def expression_globals(self):
+		"""Global namespace of the {=expression} templates, built once per document"""
+		if self.expressionglobals is None:
+			self.expressionglobals = self.config.globals | math.__dict__
+		return self.expressionglobals
+
+	def store_math(self, md, latex, display):
+		"""Stash a formula as raw LaTeX for the client-side renderer, return its placeholder
+		   When math rendering is enabled, a marker is stashed instead, and the formulas of the document and
+		   of its fragments are all rendered in place of their markers at the end of the conversion"""
+		if self.mathrenderer is None:
+			return md.htmlStash.store(f"\\[{latex}\\]" if display else f"\\({latex}\\)")
+		self.formulas.append((latex, display))
+		return md.htmlStash.store(EXT_MATH_MARKER.format(len(self.formulas) - 1))
+
+	def add_dependency(self, kind, name, fingerprint):
+		"""Record an input of the document with the fingerprint of its current state, see plsres.dependencies"""
+		self.dependencies[f"{kind}:{name}"] = fingerprint
+
 	def uniqueid(self):
 		"""Generate a unique ID within the document"""
 		result = f"_plsres_id_{self.currentid}"
@@ -112,12 +190,12 @@ class PLSResExtension (Extension):
 
 	def start(self):
 		self.load_cache()
-		sys.path.append(os.path.abspath("temp"))
+		os.makedirs(self.tempdir, exist_ok=True)
 
 	def finish(self):
 		"""Finish processing a document, write the cache"""
 		self.config.cache.documents[self.document.docpath]["lastcompiled"] = time.time()
-		sys.path.remove(os.path.abspath("temp"))
+		self.config.cache.documents[self.document.docpath]["dependencies"] = self.dependencies
 
 
 class MetaPreprocessor (Preprocessor):
@@ -143,7 +221,7 @@ class MetaPreprocessor (Preprocessor):
 				if (match := EXT_META_ASSIGN_REGEX.match(instruction)):
 					varname = match.group(1).strip()
 					expression = match.group(2).strip()
-					self.locals[varname] = eval(expression, self.globals, self.locals)
+					self.locals[varname] = evaluate(expression, self.globals, self.locals)
 				else:
 					raise SyntaxError(f"Invalid meta instruction at line {i} of file {self.ext.path} : `{instruction}`")
 			else:
@@ -167,7 +245,10 @@ class CodePreprocessor (Preprocessor):
 
 	def run(self, lines):
 		text = "\n".join(lines)
-		while (match := EXT_CODE_START_REGEX.search(text)) is not None:
+		blocks = []  # (stash index, highlighted HTML, result job or None)
+		pieces = []  # Output text, built in a single pass
+		position = 0
+		for match in EXT_CODE_START_REGEX.finditer(text):
 			lang = match.group("lang")
 			mode = match.group("mode")
 			if mode == "": mode = None
@@ -180,22 +261,23 @@ class CodePreprocessor (Preprocessor):
 
 			# Highlight with pygments
 			if lang is not None:
-				lexer = get_lexer_by_name(lang)
-				formatter = HtmlFormatter(linenos=params["linenos"])
-				html = highlight(highlight_code.strip("\n").rstrip(), lexer, formatter)
+				html = highlighter(self.ext.parameters).highlight(highlight_code.strip("\n").rstrip(), lang, params["linenos"])
 			else:
 				html = "<pre>" + highlight_code + "</pre>"
 			html = html.replace("`***", '<span class="code-emphasis">').replace("***`", '</span>')
 
-			# Compute the results
+			# Prepare the results, they are all computed together afterwards
+			job = None
 			if mode == "result":
-				if not params[".result.linux"] or platform.system() == "Linux":
-					html += self.run_result(exec_code, lang, mode, params)
+				if not params[".result.linux"] or sys.platform.startswith("linux"):
+					job = self.prepare_result(exec_code, lang, mode, params)
 			elif mode == "keep":
 				self.run_keep(exec_code, lang, mode, params)
 
 			placeholder = self.md.htmlStash.store(html)
-			text = text[:match.start()] + "\n" + placeholder + "\n" + text[match.end():]
+			blocks.append((self.md.htmlStash.html_counter - 1, html, job))
+			pieces.extend((text[position:match.start()], "\n", placeholder, "\n"))
+			position = match.end()
 			self.ext.currentcode += 1
 
 			deleted = set()
@@ -206,8 +288,15 @@ class CodePreprocessor (Preprocessor):
 					self.ext.keptfiles[name] -= 1
 			for name in deleted:
 				del self.ext.keptfiles[name]
-				os.remove(os.path.join("temp", name))
-		return text.split("\n")
+				del self.ext.keptsources[name]
+		pieces.append(text[position:])
+
+		self.run_results([job for _, _, job in blocks if job is not None])
+		for index, html, job in blocks:
+			if job is not None and job.result is not None:
+				html += self.build_result_html(job.params[".result.argv"], job.params[".result.stdin"], job.result["stdout"], job.result["stderr"], job.params[".result.joinfiles"])
+			self.md.htmlStash.rawHtmlBlocks[index] = html
+		return "".join(pieces).split("\n")
 
 	def preprocess_code(self, code):
 		highlight_code = ""
@@ -254,7 +343,7 @@ class CodePreprocessor (Preprocessor):
 			for param in paramstr.split(";"):
 				if "=" in param:
 					key, expression = [item.strip() for item in param.split("=")]
-					value = eval(expression, self.ext.config.globals, self.ext.locals)
+					value = evaluate(expression, self.ext.config.globals, self.ext.locals)
 				else:
 					key = param.strip()
 					value = True
@@ -283,21 +372,65 @@ class CodePreprocessor (Preprocessor):
 	def run_keep(self, code, lang, mode, params):
 		filename = params[".keep.name"]
 		keepfor = params[".keep.next"]
-		with open(os.path.join("temp", filename), "w", encoding="utf-8") as keepfile:
-			keepfile.write(code)
+		self.ext.keptsources[filename] = code
 		self.ext.keptfiles[filename] = keepfor
 
-	def run_result(self, code, lang, mode, params):
+	def prepare_result(self, code, lang, mode, params):
+		"""Build the execution job of a code block, and look its result up in the cache"""
 		if lang == "c":
-			return self.run_result_c(code, lang, mode, params)
+			code, options = self.prepare_result_c(code, params)
 		elif lang in ("py", "python"):
-			return self.run_result_python(code, lang, mode, params)
+			code, options = self.prepare_result_python(code, params)
 		else:
 			raise NotImplementedError(f"Code block result mode unavailable for language {lang}")
 
-	def run_result_c(self, code, lang, mode, params):
-		"""Compute a result in C"""
-		options = params["c.result.options"]
+		keptfiles = {name: self.ext.keptsources[name] for name in sorted(self.ext.keptfiles)}
+		toolchain = c_compiler_version() if lang == "c" else sys.version  # Another compiler may give other results
+		key = content_key(
+			lang, toolchain, code, options,
+			params[".result.argv"], params[".result.stdin"], params[".result.joinfiles"],
+			params["c.result.locale"], params["python.result.exception"], keptfiles)
+		return Attributes(lang=lang, code=code, options=options, params=params, keptfiles=keptfiles, key=key, result=self.ext.resultcache.get(key), cacheable=True)
+
+	def run_results(self, jobs):
+		"""Compute the results that are not cached, all at the same time"""
+		pending = [job for job in jobs if job.result is None]
+		if self.ext.config.quick or len(pending) == 0:  # In quick mode, only use cached results
+			return
+
+		import concurrent.futures
+		with concurrent.futures.ThreadPoolExecutor(self.ext.parameters.get("codejobs") or os.cpu_count()) as executor:  # Shared with the other build jobs
+			futures = [(job, executor.submit(self.run_sandboxed, job)) for job in pending]
+			for job, future in futures:
+				job.result = future.result()
+
+		for job in pending:
+			if job.cacheable:  # Failures are not kept, they are reported and tried again on the next build
+				self.ext.resultcache.put(job.key, job.result)
+
+	def run_sandboxed(self, job):
+		"""Run a code block in its own temporary directory, along with the kept and joined files it needs
+		   job.cacheable is cleared when the result comes from a failure that may not happen again"""
+		import shutil
+		import tempfile
+		os.makedirs(self.ext.tempdir, exist_ok=True)
+		sandbox = os.path.abspath(tempfile.mkdtemp(prefix="_plsres_", dir=self.ext.tempdir))
+		try:
+			for name, content in list(job.keptfiles.items()) + list(job.params[".result.joinfiles"]):
+				with open(os.path.join(sandbox, name), "w", encoding="utf-8") as f:
+					f.write(content)
+
+			if job.lang == "c":
+				stdout, stderr, job.cacheable = self.run_result_c(job.code, job.options, job.params, sandbox)
+			else:
+				stdout, stderr, job.cacheable = self.run_result_python(job.code, job.options, job.params, sandbox)
+		finally:
+			shutil.rmtree(sandbox, ignore_errors=True)
+		return {"stdout": stdout, "stderr": stderr}
+
+	def prepare_result_c(self, code, params):
+		"""Build the final C source and compiler options"""
+		options = list(params["c.result.options"])
 		if params["c.result.wrapmain"]:
 			code = "int main() {\n" + code + "\nreturn 0;}"
 
@@ -308,116 +441,50 @@ class CodePreprocessor (Preprocessor):
 				code = f"#include <{include}>\n" + code
 			if "math.h" in params["c.result.includes"]:
 				options.append("-lm")
+		return code, options
 
-		if self.ext.config.quick:  # Use cached results
-			stdout, stderr = self.cached_results()
-			if stdout is None or stderr is None:
-				return ""
-		else:  # Run everything in a temporary directory
-			if not os.path.exists("temp"):
-				os.mkdir("temp")
-
-			os.chdir("temp")
-
-			codefile = "_plsres_code_result.c"
-			execfile = "_plsres_code_result" + (".exe" if platform.system() == "Windows" else "")
-			with open(codefile, "w", encoding="utf-8") as f:
-				f.write(code)
-
-			# Compilation
-			command = ["gcc", "-o", execfile, codefile] + options
-			compilation = subprocess.run(command, capture_output=True)
-			if compilation.returncode != 0:
-				print(f"In document {self.ext.path}, code block\n{code}\nCompilation failed :\n{compilation.stderr.decode('utf-8')}")
-
-			# Write the joined files
-			if len(params[".result.joinfiles"]) > 0:
-				for name, content in params[".result.joinfiles"]:
-					with open(name, "w", encoding="utf-8") as f:
-						f.write(content)
-
-			# Run the program
-			command = ["." + os.path.sep + execfile] + params[".result.argv"]
-			if params["c.result.locale"]:
-				encoding = locale.getdefaultlocale()[1]
-			else:
-				encoding="utf-8"
-			result = subprocess.run(command, capture_output=True, input=params[".result.stdin"], encoding=encoding, text=True)
-			stdout = result.stdout.replace("\r\n", "\n").strip("\n").rstrip()
-			stderr = result.stderr.replace("\r\n", "\n").strip("\n").rstrip()
-
-			os.remove(codefile)
-			os.remove(execfile)
-			if len(params[".result.joinfiles"]) > 0:
-				for name, content in params[".result.joinfiles"]:
-					os.remove(name)
-
-			os.chdir("..")
-			return self.build_result_html(params[".result.argv"], params[".result.stdin"], stdout, stderr, params[".result.joinfiles"])
+	def run_result_c(self, code, options, params, sandbox):
+		"""Compute a result in C"""
+		import locale
+		import subprocess
+		codefile = "_plsres_code_result.c"
+		execfile = "_plsres_code_result" + (".exe" if sys.platform == "win32" else "")
 
-	def run_result_python(self, code, lang, mode, params):
+		# Compilation, skipped if the same program has already been compiled
+		if params["c.result.includes"] == True:
+			includes = ["stdlib.h", "stdio.h"]
+		else:
+			includes = list(reversed(params["c.result.includes"]))  # In the order they are in the code
+		errors = c_compiler(self.ext.parameters).compile(code, options, includes, sandbox, codefile, execfile)
+		if errors is not None:
+			print(f"In document {self.ext.path}, code block\n{code}\nCompilation failed :\n{errors}")
+			return "", html.escape(errors.replace("\r\n", "\n").strip("\n").rstrip()), False
+
+		# Run the program
+		command = ["." + os.path.sep + execfile] + params[".result.argv"]
+		if params["c.result.locale"]:
+			encoding = locale.getdefaultlocale()[1]
+		else:
+			encoding="utf-8"
+		with timed("c:run"):
+			result = subprocess.run(command, capture_output=True, input=params[".result.stdin"], encoding=encoding, text=True, cwd=sandbox)
+		stdout = result.stdout.replace("\r\n", "\n").strip("\n").rstrip()
+		stderr = result.stderr.replace("\r\n", "\n").strip("\n").rstrip()
+		return stdout, stderr, True
+
+	def prepare_result_python(self, code, params):
+		"""Build the final Python source"""
 		for module in params["python.result.imports"]:
 			code = f"import {module}\n" + code
+		return code, []
 
-		os.chdir("temp")
-		# Write the joined files
-		if len(params[".result.joinfiles"]) > 0:
-			for name, content in params[".result.joinfiles"]:
-				with open(name, "w", encoding="utf-8") as f:
-					f.write(content)
-
-		globals = builtins.__dict__ | self.python_builtins_patch()
-
-		sys.argv = ["script.py"] + params[".result.argv"]
-		sys.stdin = io.StringIO(params[".result.stdin"])
-		sys.stdout = io.StringIO()
-		sys.stderr = io.StringIO()
-
-		codeexception = None
-		try:
-			exec(compile(code, "!!!!", "exec", optimize=0), globals)
-		except Exception as exc:
-			if params["python.result.exception"]:
-				print(f"Traceback (most recent call last)", file=sys.stderr)
-				tb = exc.__traceback__
-				while tb is not None and tb.tb_frame.f_code.co_filename != "!!!!":
-					tb = tb.tb_next
-				while tb is not None:
-					print(f"  File \"plsres_result.py\", line {tb.tb_lineno}, in {tb.tb_frame.f_code.co_name}", file=sys.stderr)
-					print(f"    {code.splitlines()[tb.tb_lineno - 1].strip()}", file=sys.stderr)
-					tb = tb.tb_next
-				print(f"{exc.__class__.__name__}: {exc}", file=sys.stderr)
-			else:
-				codeexception = exc
-
-		stdout = sys.stdout.getvalue()
-		stderr = sys.stderr.getvalue()
-		sys.stdout.close()
-		sys.stderr.close()
-		sys.stdout = sys.__stdout__
-		sys.stderr = sys.__stderr__
-
-		if codeexception is not None:
+	def run_result_python(self, code, options, params, sandbox):
+		"""Compute a result in Python, in one of the worker interpreters"""
+		result = python_pool(self.ext.parameters).run(code, params[".result.argv"], params[".result.stdin"], sandbox, params["python.result.exception"])
+		if result["error"] is not None:
 			print(f"In document {self.ext.path}, code block\n{code}\n")
-			raise codeexception
-
-		if len(params[".result.joinfiles"]) > 0:
-			for name, content in params[".result.joinfiles"]:
-				os.remove(name)
-		os.chdir("..")
-
-		return self.build_result_html(params[".result.argv"], params[".result.stdin"], stdout, stderr, params[".result.joinfiles"])
-
-	def python_builtins_patch(self):
-		def input_patch(prompt):
-			result = input(prompt)
-			print(result)
-			return result
-
-		def debug(value):
-			sys.__stdout__.write(f"DEBUG : {str(value)}\n")
-
-		return {"input": input_patch, "debug": debug, "__name__": "__main__"}
+			raise RuntimeError(result["error"])
+		return result["stdout"], result["stderr"], not result["failed"]
 
 	def build_result_html(self, argv, stdin, stdout, stderr, joinfiles):
 		# Build the HTML result pane
@@ -438,20 +505,6 @@ class CodePreprocessor (Preprocessor):
 		htmlresult += "</div>"
 		return htmlresult
 
-	def cached_results(self):
-		"""Get the last cached results for this code block"""
-		identifier = f"code-{self.ext.currentcode}"
-		if identifier in self.ext.config.cache:
-			cache = self.ext.doc_cache()[identifier]
-			return cache["stdout"], cache["stderr"]
-		else:
-			return None, None
-
-	def cache_results(self, stdout, stderr):
-		"""Save the results of this code block"""
-		identifier = f"code-{self.ext.currentcode}"
-		self.ext.doc_cache()[identifier] = {"stdout": stdout, "stderr": stderr}
-
 
 class MathBlockProcessor (BlockProcessor):
 	"""Process math blocks
@@ -472,13 +525,7 @@ class MathBlockProcessor (BlockProcessor):
 		if (match := EXT_MATH_BLOCK_REGEX.match(blocks[0])) is not None:
 			if "$$" in match.group(1):
 				return False
-			latex = f"\\[{match.group(1)}\\]"
-			#if latex in self.ext.config.cache.math:
-			#	svg = self.ext.config.cache.math[latex]
-			#else:
-			#	svg = latex2svg(latex)["svg"]
-			#	self.ext.config.cache.math[latex] = svg
-			placeholder = self.md.htmlStash.store(latex)
+			placeholder = self.ext.store_math(self.md, match.group(1), True)
 			latexcontainer = etree.SubElement(parent, "div")
 			latexcontainer.text = placeholder
 			blocks.pop(0)
@@ -542,7 +589,7 @@ class FenceProcessor (BlockProcessor):
 		cell = etree.SubElement(row, "td")
 		cell.set("class", f"fence-cell fence-{currenttype}")
 
-		parameters = FENCE_PARAMETERS[currenttype]
+		parameters = fence_parameters(self.ext.parameters)[currenttype]
 		subblocks = []
 		for block in currentblocks:
 			block = block.strip()
@@ -558,6 +605,9 @@ class FenceProcessor (BlockProcessor):
 			subblocks.append(block)
 		self.parser.parseBlocks(cell, subblocks)
 
+# Collection path -> scanned collection, shared by all the documents compiled by the process
+_collection_index = {}
+
 class FileCollectionProcessor (BlockProcessor):
 	"""Process file collections
 	       {!collection: collection name}"""
@@ -576,41 +626,72 @@ class FileCollectionProcessor (BlockProcessor):
 
 		collecpath = os.path.join(self.ext.parameters.resources, self.ext.parameters.collections, collecname)
 		if not os.path.exists(collecpath):
+			self.ext.add_dependency("collection", collecpath, None)
 			print(f"ERROR : Collection {collecname} ({collecpath}) does not exist")
 			return False
 
-		attributes = self.load_attributes(collecpath)
-		filetree = self.load_filetree(collecpath)
-		result = self.build_html(parent, attributes, collecpath, filetree)
+		collection = self.load_collection(collecpath)
+		self.ext.add_dependency("collection", collecpath, collection.fingerprint)
+
+		# The rendered listing only depends on the collection and the site settings
+		renderkey = (self.ext.parameters.staticprefix, content_key(self.ext.config.licenses))
+		if renderkey not in collection.rendered:
+			collection.rendered[renderkey] = self.build_html(etree.Element("div"), collection.attributes, collecpath, collection.filetree)
+		parent.append(copy.deepcopy(collection.rendered[renderkey]))
 
 		blocks.pop(0)
 		return True
 
+	def load_collection(self, collecpath):
+		"""Get a collection from the index, it is only scanned again when one of its directories or YAML files changed"""
+		collection = _collection_index.get(collecpath)
+		if collection is not None and collection.signature == self.signature(collection.watched):
+			return collection
+
+		watched = [os.path.join(collecpath, "attributes.yml")]
+		attributes = self.load_attributes(collecpath)
+		filetree = self.load_filetree(collecpath, watched)
+		collection = Attributes(
+			attributes=attributes, filetree=filetree, watched=watched, signature=self.signature(watched),
+			fingerprint=collection_fingerprint(collecpath), rendered={})
+		_collection_index[collecpath] = collection
+		return collection
+
+	def signature(self, paths):
+		"""Modification times of the directories and YAML files of a collection"""
+		signature = []
+		for path in paths:
+			try:
+				signature.append(os.stat(path).st_mtime_ns)
+			except OSError:
+				signature.append(None)
+		return signature
+
 	def load_attributes(self, path):
 		attrs = Attributes(title=None, fileTypes="*")
-		with open(os.path.join(path, "attributes.yml"), "r", encoding="utf-8") as attrfile:
-			attrs.update(yaml.load(attrfile.read(), yaml.Loader))
+		attrs.update(load_yaml(os.path.join(path, "attributes.yml")))
 		return attrs
 
-	def load_filetree(self, path):
+	def load_filetree(self, path, watched):
+		"""Scan a collection directory, add the directories and licensing files that were read to `watched`"""
 		licensingpath = os.path.join(path, "licensing.yml")
+		watched.extend((path, licensingpath))
 		if os.path.exists(licensingpath):
-			with open(licensingpath, "r", encoding="utf-8") as licensingfile:
-				licensinglist = yaml.load(licensingfile.read(), yaml.Loader)
+			licensinglist = load_yaml(licensingpath)
 			licensing = {item["name"]: item for item in licensinglist["files"]}
 		else:
 			licensing = {}
 
 		tree = {}
-		for item in os.listdir(path):
-			itempath = os.path.join(path, item)
-			if os.path.isdir(itempath):
-				subtree = self.load_filetree(itempath)
-				tree[item] = {"type": "dir", "content": subtree}
-			else:
-				tree[item] = {"type": "file"}
-				if item in licensing:
-					tree[item].update(licensing[item])
+		with os.scandir(path) as entries:
+			for entry in entries:
+				if entry.is_dir():
+					subtree = self.load_filetree(entry.path, watched)
+					tree[entry.name] = {"type": "dir", "content": subtree}
+				else:
+					tree[entry.name] = {"type": "file"}
+					if entry.name in licensing:
+						tree[entry.name].update(licensing[entry.name])
 		return tree
 
 	def build_html(self, parent, attributes, collecpath, filetree):
@@ -622,6 +703,7 @@ class FileCollectionProcessor (BlockProcessor):
 		title.text = attributes["title"]
 
 		self.build_htmltree(container, attributes, "/" + collecpath.replace(os.path.sep, "/"), filetree)
+		return container
 
 	def build_htmltree(self, parent, attributes, treepath, filetree):
 		list = etree.SubElement(parent, "ul")
@@ -661,6 +743,7 @@ class ExerciseProcessor (BlockProcessor):
 	def run(self, parent, blocks):
 		match = EXT_EXERCISE_REGEX.match(blocks[0].strip())
 		exercisename = match.group("name")
+		self.ext.add_dependency("exercise", exercisename, exercise_fingerprint(self.ext.document.get("global_exercises"), exercisename))
 		try:
 			exercise = self.ext.document.global_exercises[exercisename]
 		except KeyError:
@@ -749,10 +832,7 @@ class ExerciseProcessor (BlockProcessor):
 
 
 	def render_text(self, text):
-		self.ext.ispage = False
-		md = markdown.Markdown(extensions=["tables", self.ext])
-		html = md.convert(text)
-		self.ext.ispage = True
+		html = self.ext.render_fragment(text)
 		placeholder = self.md.htmlStash.store(html)
 		return placeholder
 
@@ -768,7 +848,7 @@ class ExpressionProcessor (InlineProcessor):
 		escape = match.group(1) is None
 		expression = match.group(2)
 		format = match.group(4)
-		result = eval(expression, self.ext.config.globals | math.__dict__, self.ext.locals)
+		result = evaluate(expression, self.ext.expression_globals(), self.ext.locals)
 		if format is None:
 			string = str(result)
 		else:
@@ -793,6 +873,7 @@ class InternalLinkProcessor (InlineProcessor):
 
 		content = match.group(3)
 		element = etree.Element("a")
+		self.ext.add_dependency("link", docpath, link_fingerprint(self.ext.config, docpath))
 		if docpath in self.ext.config.linktable:
 			href = self.ext.config.linktable[docpath]
 			alt = self.ext.config.pathtable[docpath].attributes.title
@@ -870,14 +951,7 @@ class InlineMathProcessor (InlineProcessor):
 		self.ext = extension
 
 	def handleMatch(self, match, data):
-		content = match.group(1)
-		latex = f"\\({content}\\)"
-		#if latex in self.ext.config.cache.math:
-		#	svg = self.ext.config.cache.math[latex]
-		#else:
-		#	svg = latex2svg(latex)["svg"]
-		#	self.ext.config.cache.math[latex] = svg
-		placeholder = self.md.htmlStash.store(latex)
+		placeholder = self.ext.store_math(self.md, match.group(1), False)
 		return (placeholder, match.start(0), match.end())
 
 class InternalSVGProcessor (InlineProcessor):
@@ -893,17 +967,9 @@ class InternalSVGProcessor (InlineProcessor):
 		filename = os.path.join(self.ext.parameters.resources, self.ext.parameters.img, name)
 		if os.path.exists(filename):
 			try:
-				with open(filename, "r", encoding="utf-8") as svgfile:
-					svg = svgfile.read()
-
-				try:  # Try to eliminate the superfluous XML header
-					xmlstart = svg.index("<?")
-					xmlend = svg.index("?>")
-					svg = svg[xmlend + 2:]
-				except ValueError:
-					pass
-
-				placeholder = self.md.htmlStash.store(svg.strip())
+				svg = load_svg(filename, self.ext.parameters.get("svgminify", False), self.ext.parameters.get("svgprecision", 3))
+				self.ext.add_dependency("file", filename, svg.fingerprint)
+				placeholder = self.md.htmlStash.store(svg.svg)
 				#if alt is not None:
 				#	element.set("alt", alt)
 				return (placeholder, match.start(0), match.end(0))
@@ -911,6 +977,7 @@ class InternalSVGProcessor (InlineProcessor):
 				print(f"WARNING : In document {self.ext.path}, tried to load a non-SVG image with !svg : {match.group(0)}. Defaulting to !img behaviour")
 				return InternalImageProcessor.handleMatch(self, match, data)
 		else:
+			self.ext.add_dependency("file", filename, None)
 			print(f"In {self.ext.path}, file {filename} not found")
 			if alt is not None:
 				return (alt, match.start(0), match.end(0))
@@ -928,15 +995,46 @@ class InternalImageProcessor (InlineProcessor):
 		alt = match.group("alt")
 		filename = os.path.join(self.ext.parameters.resources, self.ext.parameters.img, name)
 		if os.path.exists(filename):
+			image = load_image(filename, self.ext.parameters)
+			if image is not None:
+				self.ext.add_dependency("file", filename, image.fingerprint)
+				return (self.build_picture(image, alt), match.start(0), match.end(0))
+			self.ext.add_dependency("file", filename, file_fingerprint(filename))
 			element = etree.Element("img")
 			element.set("src", f"{self.ext.parameters.staticprefix}/{self.ext.parameters.resources}/{self.ext.parameters.img}/{name}".replace("//", "/"))
 			if alt is not None:
 				element.set("alt", alt)
 			return (element, match.start(0), match.end(0))
 		else:
+			self.ext.add_dependency("file", filename, None)
 			print(f"In {self.ext.path}, file {filename} not found")
 			return None, None, None
 
+	def build_picture(self, image, alt):
+		"""Build a <picture> with a source per optimized format, and the fallback format in the <img>"""
+		picture = etree.Element("picture")
+		sizes = self.ext.parameters.get("imagesizes", "100vw")
+		for outformat, variants in image.variants.items():
+			if outformat == image.fallback:
+				continue
+			source = etree.SubElement(picture, "source")
+			source.set("type", EXT_IMAGE_FORMATS[outformat][1])
+			source.set("srcset", ", ".join(f"{url} {width}w" for url, width in variants))
+			source.set("sizes", sizes)
+		fallback = image.variants[image.fallback]
+		element = etree.SubElement(picture, "img")
+		element.set("src", fallback[-1][0])
+		if len(fallback) > 1:
+			element.set("srcset", ", ".join(f"{url} {width}w" for url, width in fallback))
+			element.set("sizes", sizes)
+		element.set("width", str(image.width))
+		element.set("height", str(image.height))
+		if alt is not None:
+			element.set("alt", alt)
+		element.set("loading", "lazy")
+		element.set("decoding", "async")
+		return picture
+
 
 class ContentTreeProcessor (Treeprocessor):
 	"""Process the titles to build the contents tree and the navbar"""
@@ -1020,16 +1118,19 @@ class ContentTreeProcessor (Treeprocessor):
 		linkdiv = etree.Element("div")
 		linkdiv.set("class", "page-links")
 		if self.ext.document.previous is not None and not self.ext.document.previous.attributes.hidden:
+			self.ext.add_dependency("link", self.ext.document.previous.docpath, link_fingerprint(self.ext.config, self.ext.document.previous.docpath))
 			prevlink = etree.SubElement(linkdiv, "a")
 			prevlink.set("class", "internal-link link-previous")
 			prevlink.set("href", self.ext.config.linktable[self.ext.document.previous.docpath])
 			prevlink.text = f"<< {self.ext.document.previous.attributes.title}"
 		if self.ext.document.category is not None and not self.ext.document.category.attributes.hidden:
+			self.ext.add_dependency("link", self.ext.document.category.docpath, link_fingerprint(self.ext.config, self.ext.document.category.docpath))
 			catlink = etree.SubElement(linkdiv, "a")
 			catlink.set("class", "internal-link link-category")
 			catlink.set("href", self.ext.config.linktable[self.ext.document.category.docpath])
 			catlink.text = f"↑ {self.ext.document.category.attributes.title}"
 		if self.ext.document.next is not None and not self.ext.document.next.attributes.hidden:
+			self.ext.add_dependency("link", self.ext.document.next.docpath, link_fingerprint(self.ext.config, self.ext.document.next.docpath))
 			nextlink = etree.SubElement(linkdiv, "a")
 			nextlink.set("class", "internal-link link-next")
 			nextlink.set("href", self.ext.config.linktable[self.ext.document.next.docpath])
@@ -1055,6 +1156,103 @@ class StyleProcessor (Treeprocessor):
 					element.set("class", "external-link")
 
 
+@functools.lru_cache(maxsize=16)
+def compile_template(template):
+	"""Split a page template into literal text and {=name} slots, once for all pages"""
+	return EXT_TEMPLATE_SLOT_REGEX.split(template)
+
+class MathPostprocessor (Postprocessor):
+	"""Render the formulas of the document and of its fragments at once, and put them in place of their markers
+	   The formulas that could not be rendered are left to the client-side renderer"""
+	def __init__(self, extension, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.ext = extension
+
+	def run(self, text):
+		formulas, self.ext.formulas = self.ext.formulas, []
+		if len(formulas) == 0:
+			return text
+		outputs = self.ext.mathrenderer.render(formulas)
+		occurrences = {}
+
+		def replace(match):
+			latex, display = formulas[int(match.group(1))]
+			output = outputs.get((latex, display))
+			if output is None:
+				if self.ext.mathrenderer.available:  # Otherwise, already reported once
+					print(f"WARNING : In {self.ext.path}, could not render the formula {latex!r}")
+				return f"\\[{latex}\\]" if display else f"\\({latex}\\)"
+			# The IDs in an SVG are prefixed per formula, and again for each repetition in the document
+			count = occurrences[(latex, display)] = occurrences.get((latex, display), 0) + 1
+			if count > 1:
+				prefix = self.ext.mathrenderer.idprefix(latex, display)
+				output = output.replace(prefix, f"{prefix}{count}-")
+			return output
+		return EXT_MATH_MARKER_REGEX.sub(replace, text)
+
+class SearchTreeProcessor (Treeprocessor):
+	"""Gather the text of each section of the document for the search index
+	   Sections start at each heading, with its anchor when the contents tree set one. Without the contents tree
+	   (documents that are not whole pages), the headings get their anchor here.
+	   The raw HTML (code blocks, fragments, formulas) is not indexed"""
+	def __init__(self, extension, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.ext = extension
+
+	def run(self, root):
+		attributes = self.ext.document.get("attributes") or {}
+		title = self.ext.locals.get("title", attributes.get("title"))
+		description = self.ext.locals.get("description", attributes.get("description"))
+		self.sections = [["", str(title or ""), [str(description or "")]]]  # The text is gathered in chunks, joined at the end
+		self.counts = [0] * 7
+		self.gather(root)
+		sections = [[anchor, heading, "".join(chunks)] for anchor, heading, chunks in self.sections]
+
+		if title is None:
+			headings = [heading for anchor, heading, text in sections[1:] if heading != ""]
+			entry = self.ext.config.pathtable.get(self.ext.document.docpath)
+			title = headings[0] if len(headings) > 0 else entry.attributes.title if entry is not None else None
+		if description is None:
+			text = " ".join("".join(text for anchor, heading, text in sections).split())
+			description = text[:EXT_SEARCH_DESCRIPTION_LENGTH] if text != "" else None
+		sections[0][1] = str(title or "")
+		self.ext.searchdata = {"title": title, "description": description, "sections": sections}
+
+	def gather(self, element):
+		if element.get("class") == "page-links":
+			return
+		if element.tag in {"h1", "h2", "h3", "h4", "h5", "h6"}:
+			text = self.strip_placeholders("".join(element.itertext()))
+			heading, _, anchor = text.partition(EXT_CONTENT_ANCHOR_SEP)
+			if element.get("id") is None and not self.ext.ispage:
+				anchor = self.section_anchor(int(element.tag[1]), anchor.strip())
+				if anchor != "":
+					element.set("id", anchor)
+			self.sections.append([element.get("id", anchor.strip()), heading.strip(), []])
+		else:
+			if element.text:
+				self.sections[-1][2].append(self.strip_placeholders(element.text) + " ")
+			for child in element:
+				self.gather(child)
+		if element.tail:
+			self.sections[-1][2].append(self.strip_placeholders(element.tail) + " ")
+
+	def section_anchor(self, level, anchor):
+		"""Anchor of a heading when the contents tree does not run : the first main title is the top of the document,
+		   the other headings are numbered by their position (section2, section21, ...) unless they have an explicit anchor"""
+		self.counts[level] += 1
+		for deeper in range(level + 1, len(self.counts)):
+			self.counts[deeper] = 0
+		if anchor != "":
+			return anchor
+		elif level == 1 and self.counts[1] == 1:
+			return ""
+		return "section" + "".join(str(count) for count in self.counts[2:level + 1])
+
+	def strip_placeholders(self, text):
+		return markdown.util.HTML_PLACEHOLDER_RE.sub(" ", text)
+
+
 class TemplatePostprocessor (Postprocessor):
 	"""Put the document into the website HTML page template and fill in some of the templated values"""
 	def __init__(self, extension, *args, **kwargs):
@@ -1062,17 +1260,15 @@ class TemplatePostprocessor (Postprocessor):
 		self.ext = extension
 
 	def run(self, htmlpage):
-		page = self.ext.config.template
-		for varname, value in self.ext.locals.items():
-			page = page.replace(f"{{={varname}}}", str(value))
-		for varname, value in self.ext.config.globals.items():
-			page = page.replace(f"{{={varname}}}", str(value))
-		page = page.replace("{=__title}", html.escape(self.ext.document.attributes.title) if self.ext.document.attributes.title is not None else "")
-		page = page.replace("{=__subtitle}", html.escape(self.ext.document.attributes.subtitle) if self.ext.document.attributes.subtitle is not None else "")
-		page = page.replace("{=__description}", html.escape(self.ext.document.attributes.description) if self.ext.document.attributes.description is not None else "")
-		page = page.replace("{=__theme_color}", self.theme_color())
-		page = page.replace("{=__content}", htmlpage)
-		page = page.replace("{=__pagenav}", self.build_pagenav())
+		attributes = self.ext.document.attributes
+		specials = {
+			"__title": html.escape(attributes.title) if attributes.title is not None else "",
+			"__subtitle": html.escape(attributes.subtitle) if attributes.subtitle is not None else "",
+			"__description": html.escape(attributes.description) if attributes.description is not None else "",
+			"__theme_color": self.theme_color(),
+			"__content": htmlpage,
+			"__pagenav": self.build_pagenav(),
+		}
 
 		parents = set()
 		currentdoc = self.ext.document.docpath
@@ -1080,12 +1276,31 @@ class TemplatePostprocessor (Postprocessor):
 			parents.add(currentdoc)
 			currentdoc = self.ext.config.parenttable[currentdoc]
 
-		for docpath in self.ext.config.pathtable:
-			if docpath in parents:
-				page = page.replace(f"{{=collapsed-{docpath}}}", "").replace(f"{{=expanded-{docpath}}}", "true").replace(f"{{=show-{docpath}}}", " show")
-			else:
-				page = page.replace(f"{{=collapsed-{docpath}}}", " collapsed").replace(f"{{=expanded-{docpath}}}", "false").replace(f"{{=show-{docpath}}}", "")
-		return page
+		# Even items are literal text, odd items are slot names
+		chunks = compile_template(self.ext.config.template)
+		page = chunks[:]
+		for index in range(1, len(chunks), 2):
+			page[index] = self.slot_value(chunks[index], specials, parents)
+		return "".join(page)
+
+	def slot_value(self, name, specials, parents):
+		"""Value of a {=name} slot in the template, local variables first, then globals and page values"""
+		if name in self.ext.locals:
+			return str(self.ext.locals[name])
+		elif name in self.ext.config.globals:
+			return str(self.ext.config.globals[name])
+		elif name in specials:
+			return specials[name]
+
+		state, _, docpath = name.partition("-")
+		if docpath in self.ext.config.pathtable:
+			if state == "collapsed":
+				return "" if docpath in parents else " collapsed"
+			elif state == "expanded":
+				return "true" if docpath in parents else "false"
+			elif state == "show":
+				return " show" if docpath in parents else ""
+		return f"{{={name}}}"  # Unknown slots are left as they are
 
 	def theme_color(self):
 		color = None
@@ -1132,7 +1347,7 @@ class JSONPostProcessor (Postprocessor):
 			#"previous": self.ext.config.linktable[self.ext.document.previous.docpath] if self.ext.document.previous is not None else None,
 			#"next": self.ext.config.linktable[self.ext.document.next.docpath] if self.ext.document.next is not None else None,
 		}
-		return json.dumps(content)
+		return json.dumps(content, separators=(",", ":"))
 
 	def build_subnav(self, tree, level=0):
 		navigation = []
@@ -0,0 +1,142 @@
+import os
+import json
+import mmap
+import array
+import struct
+
+FACET_MAGIC = b"PLSFACE1"
+FACET_HEADER = struct.Struct("<8sQ")  # Magic, length of the directory
+FACET_ITEM = "I"  # Unsigned 32-bit integers
+FACET_ITEM_SIZE = array.array(FACET_ITEM).itemsize
+
+
+def exercise_courses(exercise):
+	courses = exercise.get("courses", exercise.get("course"))
+	if courses is None:
+		return []
+	return [courses] if isinstance(courses, str) else list(courses)
+
+def collect_facets(store):
+	"""Compute the facets of all the exercises of a store. Exercises and questions are numbered in the store order
+	   Return the names, the exercise of each question, the exercise and question facets and the hint level counts"""
+	names = list(store)
+	questionexercise = []
+	exercisefacets = {"course": {}, "difficulty": {}, "type": {}, "hintlevel": {}}
+	questionfacets = {"difficulty": {}, "type": {}, "hintlevel": {}}
+	hintcounts = {}
+
+	def add(facets, facet, value, identifier):
+		identifiers = facets[facet].setdefault(str(value), [])
+		if len(identifiers) == 0 or identifiers[-1] != identifier:  # Identifiers come in order, avoid duplicates
+			identifiers.append(identifier)
+
+	for exerciseid, name in enumerate(names):
+		exercise = store[name]
+		for course in exercise_courses(exercise):
+			add(exercisefacets, "course", course, exerciseid)
+		for question in exercise.get("questions") or []:
+			questionid = len(questionexercise)
+			questionexercise.append(exerciseid)
+			for facet in ("difficulty", "type"):
+				if question.get(facet) is not None:
+					add(exercisefacets, facet, question[facet], exerciseid)
+					add(questionfacets, facet, question[facet], questionid)
+			for hint in question.get("hints") or []:
+				add(exercisefacets, "hintlevel", hint.get("level"), exerciseid)
+				add(questionfacets, "hintlevel", hint.get("level"), questionid)
+				hintcounts[str(hint.get("level"))] = hintcounts.get(str(hint.get("level")), 0) + 1
+	return names, questionexercise, {"exercise": exercisefacets, "question": questionfacets}, hintcounts
+
+def write_facets(path, store):
+	"""Write the facet index of an exercise store : a JSON directory, then sorted arrays of 32-bit identifiers"""
+	names, questionexercise, facets, hintcounts = collect_facets(store)
+	data = bytearray()
+
+	def add_array(identifiers):
+		offset = len(data)
+		data.extend(array.array(FACET_ITEM, identifiers).tobytes())
+		return [offset, len(identifiers)]
+
+	directory = {
+		"exercises": names,
+		"questionexercise": add_array(questionexercise),
+		"hintcounts": hintcounts,
+		"facets": {scope: {facet: {value: add_array(identifiers) for value, identifiers in sorted(values.items())}
+		                   for facet, values in scopefacets.items()}
+		           for scope, scopefacets in facets.items()},
+	}
+	directorydata = json.dumps(directory, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+	padding = -(FACET_HEADER.size + len(directorydata)) % FACET_ITEM_SIZE  # Keep the arrays aligned
+
+	os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+	temppath = f"{path}.{os.getpid()}.tmp"
+	with open(temppath, "wb") as facetfile:
+		facetfile.write(FACET_HEADER.pack(FACET_MAGIC, len(directorydata) + padding))
+		facetfile.write(directorydata + b" " * padding)
+		facetfile.write(data)
+	os.replace(temppath, path)
+
+
+class FacetIndex:
+	"""Query the facet index of the exercise database without loading the exercises
+	   Every facet value maps to a sorted array of identifiers, read in place from the mapped file
+
+	       index = FacetIndex("out/exdb-facets.bin")
+	       index.names(index.query(course="IF2", difficulty=[1, 2]))"""
+	def __init__(self, path):
+		with open(path, "rb") as facetfile:
+			self.map = mmap.mmap(facetfile.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, directorylength = FACET_HEADER.unpack_from(self.map, 0)
+		if magic != FACET_MAGIC:
+			raise ValueError(f"{path} is not a facet index")
+		self.directory = json.loads(self.map[FACET_HEADER.size : FACET_HEADER.size + directorylength])
+		self.data = memoryview(self.map)[FACET_HEADER.size + directorylength:].cast(FACET_ITEM)
+		self.exercises = self.directory["exercises"]
+		self.hintcounts = self.directory["hintcounts"]
+
+	def array(self, location):
+		offset, count = location
+		start = offset // FACET_ITEM_SIZE
+		return self.data[start : start + count]
+
+	def values(self, facet, scope="exercise"):
+		"""List the values of a facet"""
+		return list(self.directory["facets"][scope][facet].keys())
+
+	def ids(self, facet, value, scope="exercise"):
+		"""Get the sorted identifiers that have a facet value, an empty sequence if there are none"""
+		location = self.directory["facets"][scope][facet].get(str(value))
+		return self.array(location) if location is not None else ()
+
+	def query(self, scope="exercise", **filters):
+		"""Get the sorted identifiers that match all the filters (facet=value, or facet=[values] for any of them)
+		   Without filters, all the identifiers of the scope are returned"""
+		candidates = []
+		for facet, value in filters.items():
+			if isinstance(value, (list, tuple, set)):
+				union = set()
+				for item in value:
+					union.update(self.ids(facet, item, scope))
+				candidates.append(union)
+			else:
+				candidates.append(self.ids(facet, value, scope))
+		if len(candidates) == 0:
+			return list(range(len(self.exercises) if scope == "exercise" else self.directory["questionexercise"][1]))
+
+		candidates.sort(key=len)
+		result = set(candidates[0])
+		for candidate in candidates[1:]:
+			if len(result) == 0:
+				break
+			result.intersection_update(candidate)
+		return sorted(result)
+
+	def exercise_of(self, questionid):
+		return self.array(self.directory["questionexercise"])[questionid]
+
+	def names(self, exerciseids):
+		return [self.exercises[exerciseid] for exerciseid in exerciseids]
+
+	def close(self):
+		self.data.release()
+		self.map.close()
@@ -0,0 +1,61 @@
+import os
+import threading
+import functools
+import collections
+
+from .cache import ResultCache, content_key
+from .timing import timed
+
+
+@functools.lru_cache(maxsize=None)
+def get_lexer(lang):
+	from pygments.lexers import get_lexer_by_name  # Pygments takes long to import, only when there is code to highlight
+	return get_lexer_by_name(lang)
+
+@functools.lru_cache(maxsize=None)
+def get_formatter(linenos):
+	from pygments.formatters import HtmlFormatter
+	return HtmlFormatter(linenos=linenos)
+
+
+class Highlighter:
+	"""Highlight code with Pygments, keeping the rendered HTML in memory and on disk"""
+	def __init__(self, directory, maxsize, maxentries=4096):
+		self.store = ResultCache(directory, maxsize)
+		self.memory = collections.OrderedDict()
+		self.maxentries = maxentries
+		self.lock = threading.Lock()
+
+	def highlight(self, code, lang, linenos):
+		import pygments
+		key = content_key("highlight", pygments.__version__, lang, linenos, code)
+		with self.lock:
+			if key in self.memory:
+				self.memory.move_to_end(key)
+				return self.memory[key]
+
+		cached = self.store.get(key)
+		if cached is not None:
+			html = cached["html"]
+		else:
+			with timed("pygments"):
+				html = pygments.highlight(code, get_lexer(lang), get_formatter(linenos))
+			self.store.put(key, {"html": html})
+
+		with self.lock:
+			self.memory[key] = html
+			if len(self.memory) > self.maxentries:
+				self.memory.popitem(last=False)
+		return html
+
+
+# Highlighter of the current process
+_highlighter = None
+
+def highlighter(parameters):
+	global _highlighter
+	if _highlighter is None:
+		_highlighter = Highlighter(
+			os.path.join(parameters.get("buildcache", "cache"), "highlight"),
+			parameters.get("highlightcachesize", 128) * 1024 * 1024)
+	return _highlighter
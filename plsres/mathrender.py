@@ -0,0 +1,156 @@
+import os
+import re
+import threading
+
+from .cache import ResultCache, content_key
+
+MATH_LATEX_PREAMBLE = r"""\documentclass{article}
+\usepackage{amsmath}
+\usepackage{amssymb}
+\pagestyle{empty}
+\begin{document}
+"""
+MATH_SVG_PAGE_REGEX = re.compile(r"-(\d+)\.svg$")
+MATH_SVG_ID_REGEX = re.compile(r"""(\sid=["']|href=["']#|url\(#)""")  # Definitions of IDs and references to them
+
+
+class MathRenderer:
+	"""Render LaTeX formulas to MathML or SVG at build time, each distinct formula is only rendered once
+	   The outputs are kept on disk, the formulas that failed are not, so that they are tried again on the next build"""
+	def __init__(self, outformat, directory, maxsize, tempdir="temp"):
+		self.outformat = outformat
+		self.store = ResultCache(directory, maxsize)
+		self.tempdir = os.path.abspath(tempdir)
+		self.available = None
+		self.version = None
+		self.lock = threading.Lock()
+
+	def check(self):
+		"""Check that the rendering backend is installed, once"""
+		if self.available is None:
+			if self.outformat == "mathml":
+				try:
+					import latex2mathml
+					import latex2mathml.converter
+					self.version = getattr(latex2mathml, "__version__", None)
+					self.available = True
+				except ImportError:
+					self.available = False
+			elif self.outformat == "svg":
+				import shutil
+				self.available = shutil.which("latex") is not None and shutil.which("dvisvgm") is not None
+			else:
+				self.available = False
+			if not self.available:
+				print(f"WARNING : Math rendering to {self.outformat} is not available, formulas are left to the client-side renderer")
+		return self.available
+
+	def key(self, latex, display):
+		return content_key("math", self.outformat, self.version, display, latex)
+
+	def idprefix(self, latex, display):
+		"""Prefix of the IDs in the SVG of a formula, dvisvgm gives the same glyph IDs in all its outputs"""
+		return f"m{self.key(latex, display)[:12]}-"
+
+	def render(self, formulas):
+		"""Render a batch of (latex, display) formulas, return {(latex, display): output or None}"""
+		with self.lock:
+			if not self.check():
+				return {formula: None for formula in formulas}
+
+		results = {}
+		missing = []
+		for formula in dict.fromkeys(formulas):
+			cached = self.store.get(self.key(*formula))
+			if cached is not None and cached["output"] is not None:  # Failures were stored by older versions
+				results[formula] = cached["output"]
+			else:
+				missing.append(formula)
+
+		if len(missing) > 0:
+			if self.outformat == "mathml":
+				rendered = self.render_mathml(missing)
+			else:
+				rendered = self.render_svg(missing)
+			for formula, output in zip(missing, rendered):
+				if output is not None:
+					self.store.put(self.key(*formula), {"output": output})
+				results[formula] = output
+
+		if self.outformat == "svg":
+			for formula, output in results.items():
+				if output is not None:
+					results[formula] = MATH_SVG_ID_REGEX.sub(lambda match: match.group(0) + self.idprefix(*formula), output)
+		return results
+
+	def render_mathml(self, formulas):
+		import latex2mathml.converter
+		outputs = []
+		for latex, display in formulas:
+			try:
+				outputs.append(latex2mathml.converter.convert(latex, display="block" if display else "inline"))
+			except Exception:
+				outputs.append(None)
+		return outputs
+
+	def render_svg(self, formulas):
+		"""Render all the formulas in a single LaTeX run, one page per formula
+		   When the run fails, each formula is rendered alone to find those in error"""
+		outputs = self.run_latex(formulas)
+		if outputs is None:
+			if len(formulas) == 1:
+				return [None]
+			outputs = [self.run_latex([formula]) for formula in formulas]
+			outputs = [output[0] if output is not None else None for output in outputs]
+		return outputs
+
+	def run_latex(self, formulas):
+		import glob
+		import shutil
+		import tempfile
+		import subprocess
+		os.makedirs(self.tempdir, exist_ok=True)
+		directory = tempfile.mkdtemp(prefix="math-", dir=self.tempdir)
+		try:
+			pages = [(f"\\[{latex}\\]" if display else f"${latex}$") for latex, display in formulas]
+			with open(os.path.join(directory, "formulas.tex"), "w", encoding="utf-8") as texfile:
+				texfile.write(MATH_LATEX_PREAMBLE + "\n\\newpage\n".join(pages) + "\n\\end{document}\n")
+
+			latex = subprocess.run(["latex", "-interaction=nonstopmode", "-halt-on-error", "formulas.tex"],
+			                       cwd=directory, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+			if latex.returncode != 0:
+				return None
+			dvisvgm = subprocess.run(["dvisvgm", "--no-fonts", "--exact-bbox", "--page=1-", "--output=formula-%p.svg", "formulas.dvi"],
+			                         cwd=directory, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+			if dvisvgm.returncode != 0:
+				return None
+
+			svgs = {}
+			for path in glob.glob(os.path.join(directory, "formula-*.svg")):
+				with open(path, "r", encoding="utf-8") as svgfile:
+					svg = svgfile.read()
+				svgs[int(MATH_SVG_PAGE_REGEX.search(path).group(1))] = svg[svg.index("<svg"):].strip()
+			if len(svgs) != len(formulas):  # Empty formulas do not produce any page
+				return None
+			return [svgs[page] for page in sorted(svgs.keys())]
+		except (OSError, ValueError):
+			return None
+		finally:
+			shutil.rmtree(directory, ignore_errors=True)
+
+
+# Renderer of the current process
+_math_renderer = None
+
+def math_renderer(parameters):
+	"""Get the math renderer, None if the formulas are left to the client-side renderer"""
+	global _math_renderer
+	outformat = parameters.get("mathrender", "none")
+	if outformat in (None, "none", False):
+		return None
+	if _math_renderer is None:
+		_math_renderer = MathRenderer(
+			outformat, os.path.join(parameters.get("buildcache", "cache"), "math"),
+			parameters.get("mathcachesize", 64) * 1024 * 1024,
+			parameters.get("temporary", "temp"))
+	return _math_renderer
@@ -0,0 +1,116 @@
+import os
+import gzip
+import json
+import hashlib
+import threading
+import concurrent.futures
+
+PRECOMPRESS_MANIFEST = "precompress.json"
+PRECOMPRESS_SUFFIXES = {"gzip": ".gz", "br": ".br"}
+# Files that are already compressed, nothing to gain
+PRECOMPRESS_SKIPPED = (".gz", ".br", ".zst", ".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif", ".woff", ".woff2", ".zip", ".tmp")
+# Magic bytes of the compressed files whose name does not tell it, like a bundle with bundlecompression
+PRECOMPRESS_MAGIC = (b"\x1f\x8b", b"\x28\xb5\x2f\xfd")  # gzip, zstd
+
+
+def compressors(formats):
+	"""Get the compression functions of the available formats"""
+	result = {}
+	for name in formats:
+		if name == "gzip":
+			result[name] = lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+		elif name == "br":
+			try:
+				import brotli
+				result[name] = lambda data: brotli.compress(data, quality=11)
+			except ImportError:
+				print("WARNING : brotli is not installed, no .br files are written")
+		else:
+			raise ValueError(f"Unknown precompression format {name}")
+	return result
+
+def list_outputs(directory, minsize):
+	outputs = []
+	for dirpath, dirnames, filenames in os.walk(directory):
+		for filename in filenames:
+			path = os.path.join(dirpath, filename)
+			if filename == PRECOMPRESS_MANIFEST or filename.lower().endswith(PRECOMPRESS_SKIPPED):
+				continue
+			if os.path.getsize(path) >= minsize:
+				outputs.append(path)
+	return outputs
+
+def write_atomic(path, data):
+	temppath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+	with open(temppath, "wb") as outfile:
+		outfile.write(data)
+	os.replace(temppath, path)
+
+def remove_sibling(path, name):
+	try:
+		os.remove(path + PRECOMPRESS_SUFFIXES[name])
+	except FileNotFoundError:
+		pass
+
+def compress_file(path, previous, methods):
+	"""Write the compressed siblings of a file, unless it did not change since they were written
+	   Return the manifest entry of the file, None if the file is already compressed"""
+	with open(path, "rb") as infile:
+		data = infile.read()
+	if data.startswith(PRECOMPRESS_MAGIC):
+		return None, False
+
+	# Siblings of the formats that are not written anymore
+	if previous is not None:
+		for name in PRECOMPRESS_SUFFIXES:
+			if name in previous and name not in methods:
+				remove_sibling(path, name)
+				previous = {key: value for key, value in previous.items() if key != name}
+
+	digest = hashlib.sha256(data).hexdigest()
+	if previous is not None and previous["hash"] == digest and all(
+			name in previous and os.path.exists(path + PRECOMPRESS_SUFFIXES[name]) for name in methods):
+		return previous, False
+
+	entry = {"hash": digest, "size": len(data)}
+	for name, compress in methods.items():
+		compressed = compress(data)
+		write_atomic(path + PRECOMPRESS_SUFFIXES[name], compressed)
+		entry[name] = len(compressed)
+	return entry, True
+
+def precompress_output(parameters, jobs=None):
+	"""Write .gz and .br files next to the output files, so that they can be served with Content-Encoding as they are
+	   Only the files whose content changed since the last run are compressed again, a manifest of the sizes
+	   and hashes is kept in the output directory"""
+	directory = parameters.output
+	manifestpath = os.path.join(directory, PRECOMPRESS_MANIFEST)
+	try:
+		with open(manifestpath, "r", encoding="utf-8") as manifestfile:
+			manifest = json.load(manifestfile)
+	except (OSError, ValueError):
+		manifest = {}
+	methods = compressors(parameters.get("precompressformats", ["gzip", "br"]))
+
+	outputs = list_outputs(directory, parameters.get("precompressminsize", 256))
+	newmanifest = {}
+	compressed = 0
+	with concurrent.futures.ThreadPoolExecutor(jobs or os.cpu_count() or 1) as executor:  # zlib and brotli release the GIL
+		futures = {}
+		for path in outputs:
+			relpath = os.path.relpath(path, directory).replace(os.path.sep, "/")
+			futures[relpath] = executor.submit(compress_file, path, manifest.get(relpath), methods)
+		for relpath, future in futures.items():
+			entry, changed = future.result()
+			if entry is not None:
+				newmanifest[relpath] = entry
+			compressed += changed
+
+	# Remove the siblings of the files that are gone, that became too small or that are compressed already
+	for relpath in manifest.keys() - newmanifest.keys():
+		for name in PRECOMPRESS_SUFFIXES:
+			remove_sibling(os.path.join(directory, relpath), name)
+
+	write_atomic(manifestpath, json.dumps(newmanifest, separators=(",", ":"), sort_keys=True).encode("utf-8"))
+	print(f"Precompressed {compressed}/{len(newmanifest)} output files")
+	return newmanifest
@@ -0,0 +1,97 @@
+"""Python code block worker, runs the code it receives in a separate interpreter
+   Started by plsres.runner, it must not import anything from plsres so that it starts fast.
+   Protocol : one JSON request per line on stdin, one JSON response per line on the original stdout"""
+import os
+import io
+import sys
+import json
+import builtins
+
+# The directory of this script comes first in sys.path, the code blocks must import the standard modules
+# and not the modules of plsres that may have the same name
+if len(sys.path) > 0 and os.path.abspath(sys.path[0]) == os.path.dirname(os.path.abspath(__file__)):
+	del sys.path[0]
+
+
+def python_builtins_patch():
+	def input_patch(prompt):
+		result = input(prompt)
+		print(result)
+		return result
+
+	def debug(value):
+		sys.__stdout__.write(f"DEBUG : {str(value)}\n")
+		sys.__stdout__.flush()
+
+	return {"input": input_patch, "debug": debug, "__name__": "__main__"}
+
+def format_exception(exc, code):
+	"""Format the exception like a traceback that only shows the code block lines"""
+	result = "Traceback (most recent call last)\n"
+	tb = exc.__traceback__
+	while tb is not None and tb.tb_frame.f_code.co_filename != "!!!!":
+		tb = tb.tb_next
+	while tb is not None:
+		result += f"  File \"plsres_result.py\", line {tb.tb_lineno}, in {tb.tb_frame.f_code.co_name}\n"
+		result += f"    {code.splitlines()[tb.tb_lineno - 1].strip()}\n"
+		tb = tb.tb_next
+	result += f"{exc.__class__.__name__}: {exc}\n"
+	return result
+
+def run(request):
+	code = request["code"]
+	directory = request["directory"]
+	workdir = os.getcwd()
+	os.chdir(directory)
+	sys.path.insert(0, directory)  # To import the kept files
+
+	globals = builtins.__dict__ | python_builtins_patch()
+	sys.argv = ["script.py"] + request["argv"]
+	sys.stdin = io.StringIO(request["stdin"])
+	sys.stdout = io.StringIO()
+	sys.stderr = io.StringIO()
+
+	error = None
+	try:
+		exec(compile(code, "!!!!", "exec", optimize=0), globals)
+	except BaseException as exc:  # Including sys.exit(), that ends the code block and not the worker
+		if isinstance(exc, SystemExit) and exc.code in (None, 0):
+			pass
+		elif request["exception"]:
+			print(format_exception(exc, code), end="", file=sys.stderr)
+		else:
+			error = format_exception(exc, code)
+
+	stdout = sys.stdout.getvalue()
+	stderr = sys.stderr.getvalue()
+	sys.stdin = sys.__stdin__
+	sys.stdout = sys.__stdout__
+	sys.stderr = sys.__stderr__
+
+	sys.path.remove(directory)
+	os.chdir(workdir)
+	for name, module in list(sys.modules.items()):  # Forget the modules imported from the kept files
+		if getattr(module, "__file__", None) is not None and module.__file__.startswith(directory):
+			del sys.modules[name]
+	return {"stdout": stdout, "stderr": stderr, "error": error}
+
+def main():
+	# Keep the original stdout for the responses, anything else the code writes there goes to stderr
+	channel = os.fdopen(os.dup(sys.__stdout__.fileno()), "w", encoding="utf-8")
+	os.dup2(sys.__stderr__.fileno(), sys.__stdout__.fileno())
+
+	if len(sys.argv) > 1 and int(sys.argv[1]) > 0:
+		try:
+			import resource
+			memory = int(sys.argv[1])
+			resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+		except (ImportError, ValueError, OSError):
+			pass
+
+	for line in sys.__stdin__:
+		response = run(json.loads(line))
+		channel.write(json.dumps(response) + "\n")
+		channel.flush()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,223 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import functools
+import threading
+
+from .cache import BinaryStore, content_key
+from .timing import timed
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pyworker.py")
+
+
+class PythonWorker:
+	"""A warm Python interpreter that runs code blocks, see plsres/pyworker.py"""
+	def __init__(self, memory):
+		import subprocess
+		self.process = subprocess.Popen(
+			[sys.executable, WORKER_SCRIPT, str(memory)],
+			stdin=subprocess.PIPE, stdout=subprocess.PIPE, encoding="utf-8")
+		self.timedout = False
+
+	def expire(self):
+		self.timedout = True
+		self.process.kill()
+
+	def run(self, request, timeout):
+		"""Send a request and wait for the response, None if the worker timed out or crashed"""
+		timer = threading.Timer(timeout, self.expire)
+		timer.start()
+		try:
+			self.process.stdin.write(json.dumps(request) + "\n")
+			self.process.stdin.flush()
+			response = self.process.stdout.readline()
+		except (BrokenPipeError, OSError):
+			response = ""
+		finally:
+			timer.cancel()
+		if response == "":
+			self.process.kill()
+			self.process.wait()
+			return None
+		return json.loads(response)
+
+	def alive(self):
+		return self.process.poll() is None
+
+	def close(self):
+		import subprocess
+		if self.alive():
+			self.process.stdin.close()
+			try:
+				self.process.wait(timeout=5)
+			except subprocess.TimeoutExpired:
+				self.process.kill()
+
+
+class PythonRunnerPool:
+	"""Pool of warm Python workers, to run many code blocks concurrently and out of the compiler process"""
+	def __init__(self, timeout, memory):
+		self.timeout = timeout
+		self.memory = memory
+		self.idle = queue.SimpleQueue()
+		self.workers = []
+		self.lock = threading.Lock()
+		self.pid = os.getpid()
+		atexit.register(self.close)
+
+	def acquire(self):
+		try:
+			return self.idle.get_nowait()
+		except queue.Empty:
+			worker = PythonWorker(self.memory)
+			with self.lock:
+				self.workers.append(worker)
+			return worker
+
+	def release(self, worker):
+		if worker.alive():
+			self.idle.put(worker)
+		else:
+			with self.lock:
+				self.workers.remove(worker)
+
+	def run(self, code, argv, stdin, directory, exception):
+		"""Run some code in the given directory, return the dict {stdout, stderr, error, failed}
+		   `error` is the formatted traceback when the code raised and `exception` is False
+		   `failed` is set when the worker timed out or crashed, the result must not be kept"""
+		worker = self.acquire()
+		try:
+			request = {"code": code, "argv": argv, "stdin": stdin, "directory": directory, "exception": exception}
+			with timed("python:exec"):
+				response = worker.run(request, self.timeout)
+		finally:
+			self.release(worker)
+
+		if response is None:
+			if worker.timedout:
+				message = f"TimeoutError: the code took more than {self.timeout} seconds\n"
+			else:
+				message = f"the Python worker stopped unexpectedly (exit code {worker.process.returncode})\n"
+			if exception:
+				return {"stdout": "", "stderr": message, "error": None, "failed": True}
+			return {"stdout": "", "stderr": "", "error": message, "failed": True}
+		response["failed"] = False
+		return response
+
+	def close(self):
+		with self.lock:
+			workers, self.workers = self.workers, []
+		for worker in workers:
+			worker.close()
+
+
+# Pool of the current process, started with the first Python code block
+_python_pool = None
+_python_pool_lock = threading.Lock()
+
+def python_pool(parameters):
+	global _python_pool
+	with _python_pool_lock:
+		if _python_pool is None or _python_pool.pid != os.getpid():  # Do not share the workers with a forked process
+			_python_pool = PythonRunnerPool(
+				parameters.get("pythontimeout", 10),
+				parameters.get("pythonmemory", 512) * 1024 * 1024)
+		return _python_pool
+
+
+@functools.cache
+def c_compiler_version():
+	"""First line of `gcc --version`, looked up once per process, or None if gcc is not available"""
+	import subprocess
+	try:
+		return subprocess.run(["gcc", "--version"], capture_output=True, encoding="utf-8").stdout.split("\n")[0]
+	except OSError:
+		return None
+
+
+class CCompiler:
+	"""Compile C code blocks, reusing precompiled headers and previously compiled programs"""
+	def __init__(self, directory, maxsize):
+		self.binaries = BinaryStore(os.path.join(directory, "bin"), maxsize)
+		self.pchdir = os.path.join(directory, "pch")
+		self.locks = {}
+		self.lock = threading.Lock()
+
+	@property
+	def version(self):
+		return c_compiler_version()
+
+	def keylock(self, key):
+		"""Lock to avoid doing the same work twice at the same time in this process"""
+		with self.lock:
+			return self.locks.setdefault(key, threading.Lock())
+
+	def compile(self, code, options, includes, sandbox, codefile, execfile):
+		"""Put the executable for `code` at `execfile` in the sandbox, return None on success or the compiler messages"""
+		import subprocess
+		if self.version is None:
+			return "gcc is not available"
+		key = content_key("c", self.version, code, options)
+		with self.keylock(key):
+			if self.binaries.get(key, os.path.join(sandbox, execfile)):
+				return None
+
+			with open(os.path.join(sandbox, codefile), "w", encoding="utf-8") as f:
+				f.write(code)
+
+			command = ["gcc", "-o", execfile, codefile] + options
+			header = self.precompiled_header(includes, options)
+			if header is not None:
+				command = ["gcc", "-include", header, "-o", execfile, codefile] + options
+			with timed("gcc:compile"):
+				compilation = subprocess.run(command, capture_output=True, cwd=sandbox)
+			if compilation.returncode != 0:
+				return compilation.stderr.decode("utf-8")
+
+			self.binaries.put(key, os.path.join(sandbox, execfile))
+			return None
+
+	def precompiled_header(self, includes, options):
+		"""Get the path to a header that includes `includes` and has been precompiled, or None if not possible"""
+		import subprocess
+		if len(includes) == 0:
+			return None
+		compileoptions = [option for option in options if not option.startswith(("-l", "-L"))]
+		key = content_key("pch", self.version, includes, compileoptions)
+		directory = os.path.abspath(os.path.join(self.pchdir, key))
+		header = os.path.join(directory, "plsres_pch.h")
+		if os.path.exists(header + ".gch"):
+			return header
+
+		with self.keylock(key):
+			if os.path.exists(header + ".gch"):
+				return header
+			os.makedirs(directory, exist_ok=True)
+			with open(header, "w", encoding="utf-8") as f:
+				f.write("".join(f"#include <{include}>\n" for include in includes))
+
+			temppath = f"{header}.{os.getpid()}.{threading.get_ident()}.gch"
+			with timed("gcc:pch"):
+				compilation = subprocess.run(["gcc", "-x", "c-header", "-o", temppath, header] + compileoptions, capture_output=True)
+			if compilation.returncode != 0:
+				if os.path.exists(temppath):
+					os.remove(temppath)
+				return None
+			os.replace(temppath, header + ".gch")
+			return header
+
+
+# Compiler of the current process
+_c_compiler = None
+_c_compiler_lock = threading.Lock()
+
+def c_compiler(parameters):
+	global _c_compiler
+	with _c_compiler_lock:
+		if _c_compiler is None:
+			_c_compiler = CCompiler(
+				parameters.get("buildcache", "cache"),
+				parameters.get("binarycachesize", 512) * 1024 * 1024)
+		return _c_compiler
@@ -0,0 +1,134 @@
+import os
+import re
+import json
+import threading
+import unicodedata
+
+SEARCH_TOKEN_REGEX = re.compile(r"\w+")
+SEARCH_MIN_LENGTH = 2
+
+
+def normalize(text):
+	"""Lowercase and remove the accents, so that searching "ecrire" finds "Écrire" """
+	text = unicodedata.normalize("NFKD", text.lower())
+	return "".join(char for char in text if not unicodedata.combining(char))
+
+def tokenize(text):
+	return [token for token in SEARCH_TOKEN_REGEX.findall(normalize(text)) if len(token) >= SEARCH_MIN_LENGTH]
+
+def document_postings(sections):
+	"""Count the terms of each section of a document, term -> [section, count, section, count, ...]"""
+	postings = {}
+	for sectionid, (anchor, heading, text) in enumerate(sections):
+		counts = {}
+		for token in tokenize(heading) * 3 + tokenize(text):  # A term in a heading weighs more
+			counts[token] = counts.get(token, 0) + 1
+		for token, count in counts.items():
+			postings.setdefault(token, []).extend((sectionid, count))
+	return postings
+
+def write_json(path, value):
+	temppath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+	with open(temppath, "w", encoding="utf-8") as outfile:
+		json.dump(value, outfile, separators=(",", ":"), ensure_ascii=False)
+	os.replace(temppath, path)
+
+
+class SearchIndex:
+	"""Inverted index of the documents, sharded by term prefix so that clients only fetch the shards they need
+
+	   <directory>/documents.json : [[docpath, title, description, [[anchor, heading], ...]] or null, ...]
+	   <directory>/<prefix>.json : {term: [document, section, count, document, section, count, ...]}
+
+	   The terms of each document are kept in a state file, so that updating a document only rewrites
+	   the shards of its old and new terms"""
+	def __init__(self, directory, statepath, prefixlength=2):
+		self.directory = directory
+		self.statepath = statepath
+		self.prefixlength = prefixlength
+		try:
+			with open(statepath, "r", encoding="utf-8") as statefile:
+				state = json.load(statefile)
+		except (OSError, ValueError):
+			state = None
+		if state is None or state.get("prefixlength") != prefixlength or not os.path.exists(os.path.join(directory, "documents.json")):
+			state = {"prefixlength": prefixlength, "documents": [], "ids": {}, "prefixes": {}}
+		self.state = state
+		self.pending = {}  # Document ID -> new postings, None to remove the document
+
+	def shardname(self, term):
+		return term[:self.prefixlength]
+
+	def __contains__(self, docpath):
+		return docpath in self.state["ids"]
+
+	def update(self, docpath, data):
+		"""Replace the entry of a document with the search data gathered by SearchTreeProcessor
+		   The document is removed when there is nothing to index (None)"""
+		if data is None:
+			self.remove(docpath)
+			return
+		ids = self.state["ids"]
+		if docpath not in ids:
+			ids[docpath] = len(self.state["documents"])
+			self.state["documents"].append(None)
+		docid = ids[docpath]
+		self.state["documents"][docid] = [docpath, data["title"], data["description"], [[anchor, heading] for anchor, heading, text in data["sections"]]]
+		self.pending[docid] = document_postings(data["sections"])
+
+	def remove(self, docpath):
+		if docpath in self.state["ids"]:
+			docid = self.state["ids"].pop(docpath)
+			self.state["documents"][docid] = None
+			self.pending[docid] = None
+
+	def save(self):
+		"""Write the shards that changed, the document table and the state"""
+		if len(self.pending) == 0 and os.path.exists(os.path.join(self.directory, "documents.json")):
+			return 0
+		os.makedirs(self.directory, exist_ok=True)
+		prefixes = self.state["prefixes"]  # Document ID -> shards it appears in
+		shards = {}  # Shard -> {document ID: postings of the terms of this shard}
+		for docid, postings in self.pending.items():
+			for shard in prefixes.get(str(docid), []):
+				shards.setdefault(shard, {})
+			newprefixes = set()
+			for term, termpostings in (postings or {}).items():
+				shard = self.shardname(term)
+				newprefixes.add(shard)
+				shards.setdefault(shard, {}).setdefault(docid, {})[term] = termpostings
+			if postings is None:
+				prefixes.pop(str(docid), None)
+			else:
+				prefixes[str(docid)] = sorted(newprefixes)
+
+		for shard, updates in shards.items():
+			path = os.path.join(self.directory, f"{shard}.json")
+			try:
+				with open(path, "r", encoding="utf-8") as shardfile:
+					entries = json.load(shardfile)
+			except (OSError, ValueError):
+				entries = {}
+			changed = set(self.pending.keys())
+			for term in list(entries.keys()):
+				flat = entries[term]
+				kept = [value for i in range(0, len(flat), 3) if flat[i] not in changed for value in flat[i:i+3]]
+				if len(kept) > 0:
+					entries[term] = kept
+				else:
+					del entries[term]
+			for docid, terms in sorted(updates.items()):
+				for term, termpostings in terms.items():
+					flat = entries.setdefault(term, [])
+					for i in range(0, len(termpostings), 2):
+						flat.extend((docid, termpostings[i], termpostings[i + 1]))
+			if len(entries) > 0:
+				write_json(path, dict(sorted(entries.items())))
+			elif os.path.exists(path):
+				os.remove(path)
+
+		write_json(os.path.join(self.directory, "documents.json"), self.state["documents"])
+		os.makedirs(os.path.dirname(self.statepath) or ".", exist_ok=True)
+		write_json(self.statepath, self.state)
+		self.pending = {}
+		return len(shards)
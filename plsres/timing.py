@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+import contextlib
+
+# Profiler of the current process, None when the build is not profiled
+_profiler = None
+
+# Method that does the work of each kind of Markdown processor
+PROFILE_REGISTRIES = (
+	("preprocessors", "run", "pre"),
+	("blockprocessors", "run", "block"),
+	("inlinePatterns", "handleMatch", "inline"),
+	("treeprocessors", "run", "tree"),
+	("postprocessors", "run", "post"),
+)
+
+
+class Profiler:
+	"""Collect the timings of the build stages, see --profile
+	   Each event is (stage, document, start, duration, self time, pid, thread id), the self time
+	   excludes the nested stages that run in the same thread"""
+	def __init__(self):
+		self.events = []
+		self.document = None
+		self.local = threading.local()
+		self.lock = threading.Lock()
+
+	@contextlib.contextmanager
+	def timed(self, name):
+		stack = self.local.__dict__.setdefault("stack", [])
+		nested = [0.0]
+		stack.append(nested)
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			duration = time.perf_counter() - start
+			stack.pop()
+			if len(stack) > 0:
+				stack[-1][0] += duration
+			with self.lock:
+				self.events.append((name, self.document, start, duration, duration - nested[0], os.getpid(), threading.get_ident()))
+
+	@contextlib.contextmanager
+	def compiling(self, docpath):
+		self.document = docpath
+		try:
+			with self.timed("document"):
+				yield
+		finally:
+			self.document = None
+
+	def drain(self):
+		"""Take the events collected so far"""
+		with self.lock:
+			events, self.events = self.events, []
+		return events
+
+
+def enable():
+	"""Start profiling in this process, the pool workers are enabled by init_worker"""
+	global _profiler
+	_profiler = Profiler()
+	return _profiler
+
+def enabled():
+	return _profiler is not None
+
+def timed(name):
+	"""Context manager that times a stage of the build when profiling"""
+	if _profiler is None:
+		return contextlib.nullcontext()
+	return _profiler.timed(name)
+
+def compiling(docpath):
+	"""Context manager around the compilation of a whole document"""
+	if _profiler is None:
+		return contextlib.nullcontext()
+	return _profiler.compiling(docpath)
+
+def drain():
+	return _profiler.drain() if _profiler is not None else []
+
+def add_events(events):
+	"""Merge the events sent back by a worker process"""
+	if _profiler is not None:
+		with _profiler.lock:
+			_profiler.events.extend(tuple(event) for event in events)
+
+def wrap(method, name):
+	@functools.wraps(method)
+	def timed_method(*args, **kwargs):
+		with _profiler.timed(name):
+			return method(*args, **kwargs)
+	return timed_method
+
+def instrument(md):
+	"""Time every processor registered in a Markdown instance, when profiling"""
+	if _profiler is None:
+		return
+	for registryname, methodname, kind in PROFILE_REGISTRIES:
+		registry = md.parser.blockprocessors if registryname == "blockprocessors" else getattr(md, registryname)
+		for processor in registry:
+			setattr(processor, methodname, wrap(getattr(processor, methodname), f"{kind}:{processor.__class__.__name__}"))
+
+
+def summarize(events):
+	"""Aggregate the events per stage and per document"""
+	stages = {}
+	documents = {}
+	for name, document, start, duration, selftime, pid, tid in events:
+		stage = stages.setdefault(name, {"calls": 0, "total": 0.0, "self": 0.0})
+		stage["calls"] += 1
+		stage["total"] += duration
+		stage["self"] += selftime
+		if document is not None:
+			entry = documents.setdefault(document, {"total": 0.0, "stages": {}})
+			if name == "document":
+				entry["total"] += duration
+			else:
+				entry["stages"][name] = entry["stages"].get(name, 0.0) + selftime
+	return {"stages": stages, "documents": documents}
+
+def text_report(summary, top=20):
+	lines = [f"{'Stage' :<40} {'Calls' :>8} {'Total (s)' :>10} {'Self (s)' :>10}"]
+	for name, stage in sorted(summary["stages"].items(), key=lambda item: item[1]["self"], reverse=True):
+		lines.append(f"{name :<40} {stage['calls'] :>8} {stage['total'] :>10.3f} {stage['self'] :>10.3f}")
+
+	lines.append("")
+	lines.append(f"Slowest documents (of {len(summary['documents'])})")
+	documents = sorted(summary["documents"].items(), key=lambda item: item[1]["total"], reverse=True)
+	for docpath, entry in documents[:top]:
+		heaviest = sorted(entry["stages"].items(), key=lambda item: item[1], reverse=True)[:3]
+		details = ", ".join(f"{name} {selftime :.3f}s" for name, selftime in heaviest)
+		lines.append(f"{docpath or '<stdin>' :<40} {entry['total'] :>8.3f}s  ({details})")
+	return "\n".join(lines)
+
+def trace_events(events):
+	"""Convert the events to the Trace Event Format (chrome://tracing, Perfetto, speedscope)"""
+	if len(events) == 0:
+		return {"traceEvents": []}
+	origin = min(event[2] for event in events)
+	return {"traceEvents": [{
+		"name": name, "cat": "plsres", "ph": "X",
+		"ts": (start - origin) * 1e6, "dur": duration * 1e6,
+		"pid": pid, "tid": tid, "args": {"document": document},
+	} for name, document, start, duration, selftime, pid, tid in events]}
+
+def report(jsonpath=None, tracepath=None):
+	"""Print the timing report of the build, and write it in the requested formats"""
+	events = drain()
+	summary = summarize(events)
+	print(text_report(summary), file=sys.stderr)  # The document itself may be on stdout
+	if jsonpath is not None:
+		with open(jsonpath, "w", encoding="utf-8") as reportfile:
+			json.dump(summary, reportfile, indent=1)
+	if tracepath is not None:
+		with open(tracepath, "w", encoding="utf-8") as tracefile:
+			json.dump(trace_events(events), tracefile)
@@ -0,0 +1,209 @@
+import os
+import sys
+import time
+import struct
+import select
+import threading
+import functools
+import http.server
+
+from .util import Attributes
+from .build import SiteCompiler, compile_site
+
+# inotify event flags, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+IN_WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+IN_EVENT_HEADER = struct.Struct("iIII")
+
+# The preview pages ask the server for the number of the last build, and reload when it changes
+PREVIEW_BUILD_PATH = "/__plsres_build"
+PREVIEW_RELOAD_SCRIPT = b"""<script>(function () {
+	let build = null;
+	setInterval(function () {
+		fetch("/__plsres_build").then(response => response.text()).then(function (current) {
+			if (build !== null && current !== build) location.reload();
+			build = current;
+		}).catch(function () {});
+	}, 1000);
+})();</script>"""
+
+
+class InotifyWatcher:
+	"""Watch directory trees with inotify, Linux only"""
+	def __init__(self, directories):
+		import ctypes
+		import ctypes.util
+		self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+		self.fd = self.libc.inotify_init()
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_init failed")
+		self.watches = {}  # Watch descriptor -> directory
+		for directory in directories:
+			self.add_tree(directory)
+
+	def add_tree(self, directory):
+		for dirpath, dirnames, filenames in os.walk(directory):
+			wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), IN_WATCH_MASK)
+			if wd >= 0:
+				self.watches[wd] = dirpath
+
+	def wait(self, timeout=None):
+		"""Wait for changes, return the set of changed paths (empty on timeout)"""
+		changed = set()
+		while True:
+			ready, _, _ = select.select([self.fd], [], [], timeout)
+			if len(ready) == 0:
+				return changed
+			data = os.read(self.fd, 65536)
+			offset = 0
+			while offset < len(data):
+				wd, mask, cookie, length = IN_EVENT_HEADER.unpack_from(data, offset)
+				name = data[offset + IN_EVENT_HEADER.size : offset + IN_EVENT_HEADER.size + length].rstrip(b"\0")
+				offset += IN_EVENT_HEADER.size + length
+				path = os.path.join(self.watches.get(wd, ""), os.fsdecode(name))
+				changed.add(path)
+				if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+					self.add_tree(path)
+			timeout = 0.1  # Gather the events that come together (editor saves, git checkouts, ...)
+
+	def close(self):
+		if self.fd >= 0:
+			os.close(self.fd)  # Also removes the watches
+			self.fd = -1
+
+
+class PollingWatcher:
+	"""Watch directory trees by scanning their modification times"""
+	def __init__(self, directories, interval=0.5):
+		self.directories = directories
+		self.interval = interval
+		self.state = self.scan()
+
+	def scan(self):
+		state = {}
+		for directory in self.directories:
+			for dirpath, dirnames, filenames in os.walk(directory):
+				for name in filenames:
+					path = os.path.join(dirpath, name)
+					try:
+						stat = os.stat(path)
+						state[path] = (stat.st_mtime_ns, stat.st_size)
+					except OSError:
+						pass
+		return state
+
+	def wait(self, timeout=None):
+		deadline = None if timeout is None else time.monotonic() + timeout
+		while deadline is None or time.monotonic() < deadline:
+			time.sleep(self.interval)
+			state = self.scan()
+			changed = {path for path in state.keys() | self.state.keys() if state.get(path) != self.state.get(path)}
+			self.state = state
+			if len(changed) > 0:
+				return changed
+		return set()
+
+	def close(self):
+		pass
+
+
+def make_watcher(directories):
+	"""Use inotify when available, fall back to polling elsewhere"""
+	if sys.platform.startswith("linux"):
+		try:
+			return InotifyWatcher(directories)
+		except (OSError, AttributeError, TypeError):
+			pass
+	return PollingWatcher(directories)
+
+class PreviewHandler (http.server.SimpleHTTPRequestHandler):
+	"""Serve the output directory, with a script in the HTML pages that reloads them after each build"""
+	def do_GET(self):
+		if self.path == PREVIEW_BUILD_PATH:
+			return self.send_content(str(self.server.build).encode("utf-8"), "text/plain")
+
+		path = self.translate_path(self.path)
+		if os.path.isdir(path) and self.path.endswith("/"):
+			path = os.path.join(path, "index.html")
+		if not path.endswith(".html") or not os.path.isfile(path):
+			return super().do_GET()
+		with open(path, "rb") as pagefile:
+			page = pagefile.read()
+		index = page.rfind(b"</body>")
+		if index < 0:
+			index = len(page)
+		self.send_content(page[:index] + PREVIEW_RELOAD_SCRIPT + page[index:], "text/html; charset=utf-8")
+
+	def send_content(self, content, contenttype):
+		self.send_response(200)
+		self.send_header("Content-Type", contenttype)
+		self.send_header("Content-Length", str(len(content)))
+		self.send_header("Cache-Control", "no-cache")
+		self.end_headers()
+		self.wfile.write(content)
+
+def serve_output(parameters, port):
+	"""Serve the output directory for previews, in a background thread
+	   server.build is the number of the last build, the pages reload when it changes"""
+	os.makedirs(parameters.output, exist_ok=True)
+	handler = functools.partial(PreviewHandler, directory=parameters.output)
+	server = http.server.ThreadingHTTPServer(("127.0.0.1", port), handler)
+	server.build = 0
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	print(f"Serving {parameters.output} at http://127.0.0.1:{port}/")
+	return server
+
+def watch_site(parameters, load_extconfig, jobs=None, port=8000, report=None):
+	"""Compile the site, then recompile what changed on every modification of the sources, resources or templates
+	   `load_extconfig` is called again to reload the templates when they change,
+	   `report` is called after each build, to print the timings with --profile
+	   The preview server serves the output directory at its root, so the links of the pages start with / there"""
+	if port is not None:
+		parameters = Attributes(parameters, linkprefix="/")
+	extconfig = load_extconfig()
+	extconfig.updateall = False
+	compile_site(parameters, extconfig, jobs)
+	if report is not None:
+		report()
+	compiler = SiteCompiler(parameters, extconfig)  # Warm compiler for the rebuilds
+	server = serve_output(parameters, port) if port is not None else None
+
+	directories = [directory for directory in (parameters.source, parameters.resources, parameters.template) if os.path.isdir(directory)]
+	watcher = make_watcher(directories)
+	print(f"Watching {', '.join(directories)} ({watcher.__class__.__name__}), press Ctrl+C to stop")
+	try:
+		while True:
+			changed = watcher.wait()
+			if len(changed) == 0:
+				continue
+			templatedir = os.path.normpath(parameters.template)
+			if any(os.path.normpath(path).startswith(templatedir) for path in changed):
+				cache = extconfig.cache
+				extconfig = load_extconfig()
+				extconfig.cache = cache
+				extconfig.updateall = False
+				compiler = SiteCompiler(parameters, extconfig)
+			print(f"{len(changed)} file(s) changed")
+			try:
+				compile_site(parameters, extconfig, 1, compiler)
+			except Exception as exc:  # Keep watching, the author will fix the document
+				print(f"ERROR : {exc.__class__.__name__}: {exc}")
+			if server is not None:
+				server.build += 1
+			if report is not None:
+				report()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		watcher.close()
+		if server is not None:
+			server.shutdown()
+			server.server_close()
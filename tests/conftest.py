@@ -0,0 +1,55 @@
+import os
+import shutil
+
+import pytest
+import markdown
+from markdown.extensions.tables import TableExtension
+
+from plsres.util import Attributes
+from plsres.extension import PLSResExtension
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_parameters(**values):
+	parameters = Attributes(
+		source="src/", resources="res/", exercises="exercises/", collections="collections/", img="img/",
+		template="template/", output="out/", temporary="temp/", cache="cache.json", buildcache="cache/",
+		linkprefix="/plsres/", pagesuffix="", staticprefix="/static/plsres/", outformat="html")
+	parameters.update(values)
+	return parameters
+
+def make_extconfig(parameters):
+	return Attributes(
+		pathtable={}, documenttree={}, linktable={}, parenttable={}, template="{=__content}", licenses={},
+		globals={}, cache=Attributes(config=None, documents={}), quick=False, updateall=True,
+		exerciseconfig=Attributes(hintLevelDescription=["", "Piste", "Méthode", "Solution"]),
+		tempdir=parameters.temporary)
+
+def write_file(path, content):
+	os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+	with open(path, "w", encoding="utf-8") as f:
+		f.write(content)
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+	"""Empty site directory with the templates of the repository, as the working directory"""
+	shutil.copytree(os.path.join(REPOSITORY, "template"), tmp_path / "template")
+	monkeypatch.chdir(tmp_path)
+	return tmp_path
+
+@pytest.fixture
+def convert(site):
+	"""Compile a single document like compile_plsmarkdown.py does with its standard input"""
+	def convert(text, document=None, quick=False, **parameters):
+		parameters = make_parameters(**parameters)
+		extconfig = make_extconfig(parameters)
+		extconfig.quick = quick
+		extension = PLSResExtension("test.md", document or Attributes(docpath=""), extconfig, parameters, ispage=False)
+		extension.start()
+		md = markdown.Markdown(extensions=[TableExtension(), extension])
+		html = md.convert(text)
+		extension.finish()
+		return html
+	return convert
@@ -0,0 +1,30 @@
+from plsres.assets import round_numbers, minify_svg, load_svg
+
+
+def test_round_numbers():
+	assert round_numbers("M10.123456,-0.0004 L5 5", 3) == "M10.123,0 L5 5"
+	assert round_numbers("translate(1.23456e2 -2.5E-1)", 3) == "translate(123.456 -0.25)"
+
+def test_round_numbers_keeps_adjacent_numbers_apart():
+	assert round_numbers("M10.1.0001 5", 3) == "M10.1 0 5"
+	assert round_numbers("M1.23456.5", 3) == "M1.235.5"
+	assert round_numbers("l1.0001.5", 3) == "l1 .5"
+	assert round_numbers("M0.00001-.00001", 3) == "M0 0"
+
+def test_round_numbers_keeps_short_numbers():
+	assert round_numbers("M1e3 10 .5", 3) == "M1e3 10 .5"
+	assert round_numbers("a1 1 0 011.5 2", 3) == "a1 1 0 011.5 2"
+
+def test_minify_svg():
+	svg = """<svg xmlns="http://www.w3.org/2000/svg" xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape" inkscape:version="1.2">
+	<!-- Comment -->
+	<metadata><rdf:RDF/></metadata>
+	<path d="M 10.123456 20.5 L 30.0001.5" />
+	<text x="1">Some   text</text></svg>"""
+	assert minify_svg(svg) == '<svg xmlns="http://www.w3.org/2000/svg"><path d="M 10.123 20.5 L 30 .5"/><text x="1">Some   text</text></svg>'
+
+def test_load_svg_line_endings(site):
+	with open("crlf.svg", "wb") as svgfile:
+		svgfile.write(b'<?xml version="1.0"?>\r\n<svg>\r\n<text>a\r\nb</text>\r\n</svg>\r\n')
+	assert load_svg("crlf.svg").svg == "<svg>\r\n<text>a\r\nb</text>\r\n</svg>"  # As in the file, unless minified
+	assert load_svg("crlf.svg", minify=True).svg == "<svg><text>a\nb</text></svg>"
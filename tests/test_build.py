@@ -0,0 +1,210 @@
+import os
+import json
+import multiprocessing
+
+import pytest
+
+from plsres import build as buildmodule, timing
+from plsres.build import SiteCompiler, compile_site, load_cache, up_to_date, output_path, list_sources, document_path, load_site_tables, load_page_template
+from plsres.bundle import BundleReader
+from plsres.dependencies import file_fingerprint, collection_fingerprint, current_fingerprint
+
+from conftest import make_parameters, make_extconfig, write_file
+from test_exdb import EXERCISE
+
+PAGE1 = """//// title = "Page 1"
+
+# {=title}
+
+See {> info.page2}
+"""
+PAGE2 = """//// title = "Page 2"
+
+# {=title}
+
+Some text
+"""
+
+
+def build(parameters, updateall=False, jobs=1):
+	"""Run a site build like compile_plsmarkdown.py --site, return the number of compiled documents"""
+	extconfig = make_extconfig(parameters)
+	extconfig.cache = load_cache(parameters)
+	extconfig.updateall = updateall
+	return compile_site(parameters, extconfig, jobs)
+
+def site_extconfig(parameters):
+	"""Configuration with the document tree of the site, as compile_site builds it"""
+	extconfig = make_extconfig(parameters)
+	extconfig.cache = load_cache(parameters)
+	load_site_tables(parameters, extconfig, [(filepath, document_path(parameters, filepath)) for filepath in list_sources(parameters)])
+	return extconfig
+
+def read_output(parameters, docpath):
+	with open(output_path(parameters, docpath), "r", encoding="utf-8") as outfile:
+		return outfile.read()
+
+@pytest.fixture
+def parameters(site):
+	write_file("src/info/1--page1.md", PAGE1)
+	write_file("src/info/2--page2.md", PAGE2)
+	return make_parameters()
+
+
+def test_file_fingerprint(site):
+	write_file("a.txt", "a")
+	fingerprint = file_fingerprint("a.txt")
+	assert fingerprint == file_fingerprint("a.txt")
+	write_file("a.txt", "b")
+	assert file_fingerprint("a.txt") != fingerprint
+	assert file_fingerprint("missing.txt") is None
+
+def test_collection_fingerprint(site):
+	write_file("collection/attributes.yml", "title: Collection")
+	write_file("collection/a.pdf", "a")
+	fingerprint = collection_fingerprint("collection")
+	write_file("collection/a.pdf", "content that is not shown")
+	assert collection_fingerprint("collection") == fingerprint
+	write_file("collection/b.pdf", "b")
+	assert collection_fingerprint("collection") != fingerprint
+	assert collection_fingerprint("missing") is None
+
+def test_site_build(parameters):
+	assert build(parameters) == 2
+	assert '<a alt="Page 2" class="internal-link" href="/plsres/info/page2.html">Page 2</a>' in read_output(parameters, "info.page1")
+
+	extconfig = make_extconfig(parameters)
+	extconfig.cache = load_cache(parameters)
+	entry = extconfig.cache.documents["info.page1"]
+	assert entry["dependencies"]["file:" + os.path.join("src", "info", "1--page1.md")] == file_fingerprint("src/info/1--page1.md")
+	assert "link:info.page2" in entry["dependencies"]
+
+def test_incremental_build(parameters):
+	assert build(parameters) == 2
+	assert build(parameters) == 0
+	assert build(parameters, updateall=True) == 2
+
+	write_file("src/info/2--page2.md", PAGE2.replace("Some text", "Other text"))
+	assert build(parameters) == 1
+	assert "Other text" in read_output(parameters, "info.page2")
+
+	# The title of page 2 is shown in the link of page 1
+	write_file("src/info/2--page2.md", PAGE2.replace("Page 2", "Second page"))
+	assert build(parameters) == 2
+	assert ">Second page</a>" in read_output(parameters, "info.page1")
+
+def test_exercise_change_rebuilds_the_document(parameters):
+	write_file("res/exercises/add.yml", EXERCISE)
+	write_file("src/info/3--exercises.md", "# Exercises\n\n{!exercise: add}\n")
+	assert build(parameters) == 3
+	assert "Addition" in read_output(parameters, "info.exercises")
+	assert build(parameters) == 0
+
+	write_file("res/exercises/add.yml", EXERCISE.replace("Addition", "Sum"))
+	assert build(parameters) == 1
+	assert "Sum" in read_output(parameters, "info.exercises")
+
+def test_rendered_exercise_database(parameters):
+	parameters.exdbrender = "out/exdb-render.json"
+	write_file("res/exercises/add.yml", EXERCISE)
+	build(parameters)
+	with open("out/exdb-render.json", "r", encoding="utf-8") as renderfile:
+		assert "Addition" in json.load(renderfile)["add"]
+	assert "" not in load_cache(parameters).documents
+
+def test_up_to_date(parameters):
+	build(parameters)
+	extconfig = site_extconfig(parameters)
+	assert up_to_date(parameters, extconfig, "info.page2")
+	assert not up_to_date(parameters, extconfig, "info.missing")
+
+	os.remove(output_path(parameters, "info.page2"))
+	assert not up_to_date(parameters, extconfig, "info.page2")
+	assert current_fingerprint("file:src/info/missing.md", extconfig, None) is None
+
+def test_deleted_sources(parameters):
+	write_file("src/other/page3.md", "# Page 3\n")
+	assert build(parameters) == 3
+	assert os.path.exists(output_path(parameters, "other.page3"))
+
+	os.remove("src/other/page3.md")
+	build(parameters)
+	assert not os.path.exists(output_path(parameters, "other.page3"))
+	assert not os.path.exists(os.path.join("out", "other"))
+	assert "other.page3" not in load_cache(parameters).documents
+
+def test_failed_build_keeps_the_previous_configuration(parameters):
+	assert build(parameters) == 2
+
+	write_file("template/licenses.yml", "licenses: []\n")  # The configuration changed, and a document is broken
+	write_file("src/info/3--broken.md", "//// not an instruction\n")
+	with pytest.raises(SyntaxError):
+		build(parameters)
+
+	os.remove("src/info/3--broken.md")
+	assert build(parameters) == 2  # Not considered up to date with the new configuration
+	assert build(parameters) == 0
+
+def test_parallel_build(parameters):
+	assert build(parameters, jobs=2) == 2
+	assert build(parameters, jobs=2) == 0
+	assert "Page 2" in read_output(parameters, "info.page1")
+
+def test_profiled_parallel_build(parameters, monkeypatch):
+	monkeypatch.setattr(timing, "_profiler", None)
+	monkeypatch.setattr(buildmodule, "multiprocessing", multiprocessing.get_context("spawn"))  # The workers do not inherit the profiler
+	timing.enable()
+	assert build(parameters, jobs=2) == 2
+	events = timing.drain()
+	assert {event[1] for event in events if event[0] == "document"} == {"info.page1", "info.page2"}
+	assert any(event[5] != os.getpid() for event in events)
+
+def test_site_pages(parameters):
+	write_file("src/info/attributes.yml", "title: Informatique\nthemeColor: [0, 128, 255]\n")
+	write_file("template/page.html", "<title>{=__title}</title><main>{=__content}</main><nav>{=__pagenav}</nav>")
+	extconfig = site_extconfig(parameters)
+	extconfig.template = load_page_template(parameters)
+	extconfig.updateall = True
+	compile_site(parameters, extconfig, 1)
+
+	page1 = read_output(parameters, "info.page1")
+	assert page1.startswith("<title>Page 1</title><main>")
+	assert '<a class="internal-link link-category" href="/plsres/info.html">↑ Informatique</a>' in page1
+	assert '<a class="internal-link link-next" href="/plsres/info/page2.html">Page 2 &gt;&gt;</a>' in page1
+	assert "link-previous" not in page1
+	assert '<a class="internal-link link-previous" href="/plsres/info/page1.html">&lt;&lt; Page 1</a>' in read_output(parameters, "info.page2")
+	assert '<a class="anchor-link" href="#">Page 1</a>' in page1
+
+	# The order of the pages follows the sections of attributes.yml, the pages that show it are compiled again
+	write_file("src/info/attributes.yml", "title: Informatique\nthemeColor: [0, 128, 255]\nsections: [page2, page1]\n")
+	assert build(parameters) == 2
+	assert "link-previous" not in read_output(parameters, "info.page2")
+	assert "Page 1 &gt;&gt;" in read_output(parameters, "info.page2")
+
+def test_json_site(parameters):
+	parameters.outformat = "json"
+	write_file("src/info/attributes.yml", "title: Informatique\nthemeColor: [0, 128, 255]\n")
+	assert build(parameters) == 2
+	record = json.loads(read_output(parameters, "info.page1"))
+	assert output_path(parameters, "info.page1").endswith(".json")
+	assert record["docpath"] == "info.page1" and record["title"] == "Page 1"
+	assert record["themeColor"] == "# 080FF"
+	assert record["pageNavigation"][0]["title"] == "Page 1"
+	assert "Page 2</a>" in record["content"]
+
+@pytest.mark.parametrize("outformat", ["html", "json"])
+def test_site_bundle(parameters, outformat):
+	parameters.outformat = outformat
+	parameters.bundle = "out/bundle.jsonl"
+	assert build(parameters) == 2
+	extconfig = site_extconfig(parameters)
+	page, _, _ = SiteCompiler(parameters, extconfig).compile(os.path.join("src", "info", "1--page1.md"), "info.page1")
+
+	reader = BundleReader("out/bundle.jsonl")
+	try:
+		if outformat == "json":
+			assert reader.get("info.page1") == json.loads(page)
+		else:
+			assert reader.get("info.page1") == {"docpath": "info.page1", "content": page}
+	finally:
+		reader.close()
@@ -0,0 +1,28 @@
+import json
+
+import pytest
+
+from plsres.bundle import write_bundle, index_path, BundleReader
+
+DOCUMENTS = [("info.page1", {"docpath": "info.page1", "content": "<p>Page 1</p>"}), ("info.page2", {"docpath": "info.page2", "content": "<p>Page 2 é</p>"})]
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip"])
+def test_bundle(site, compression):
+	index = write_bundle("out/bundle.jsonl", iter(DOCUMENTS), compression)
+	with open(index_path("out/bundle.jsonl"), "r", encoding="utf-8") as indexfile:
+		assert json.load(indexfile)["documents"] == index
+
+	reader = BundleReader("out/bundle.jsonl")
+	try:
+		for docpath, record in DOCUMENTS:
+			assert reader.get(docpath) == record
+		with pytest.raises(KeyError):
+			reader.get("info.missing")
+	finally:
+		reader.close()
+
+def test_uncompressed_bundle_is_json_lines(site):
+	write_bundle("out/bundle.jsonl", iter(DOCUMENTS))
+	with open("out/bundle.jsonl", "r", encoding="utf-8") as bundlefile:
+		assert [json.loads(line) for line in bundlefile] == [record for docpath, record in DOCUMENTS]
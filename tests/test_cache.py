@@ -0,0 +1,70 @@
+import os
+import shutil
+
+import pytest
+
+from plsres.cache import ResultCache, content_key
+
+
+def entry_size(cache, key):
+	return os.path.getsize(cache.entrypath(key))
+
+def set_last_use(cache, key, timestamp):
+	os.utime(cache.entrypath(key), (timestamp, timestamp))
+
+
+def test_content_key():
+	assert content_key("c", "int a;", []) == content_key("c", "int a;", [])
+	assert content_key("c", "int a;", []) != content_key("c", "int b;", [])
+	assert content_key(["a", "b"]) != content_key("a", "b")
+
+def test_result_cache_roundtrip(tmp_path):
+	cache = ResultCache(str(tmp_path / "results"), 1024 * 1024)
+	key = content_key("python", "print(1)")
+	assert cache.get(key) is None
+	cache.put(key, {"stdout": "1", "stderr": "é"})
+	assert cache.get(key) == {"stdout": "1", "stderr": "é"}
+	assert ResultCache(str(tmp_path / "results"), 1024 * 1024).get(key) == {"stdout": "1", "stderr": "é"}
+
+def test_result_cache_evicts_least_recently_used(tmp_path):
+	value = {"stdout": "x" * 100, "stderr": ""}
+	probe = ResultCache(str(tmp_path / "probe"), 1024 * 1024)
+	probe.put("00", value)
+	size = entry_size(probe, "00")
+
+	# Room for 3.5 entries, going above it evicts down to 3/4 of that, so 2 entries are kept
+	cache = ResultCache(str(tmp_path / "results"), size * 7 // 2)
+	for key, timestamp in (("aa", 1000), ("bb", 2000), ("cc", 3000)):
+		cache.put(key, value)
+		set_last_use(cache, key, timestamp)
+	assert cache.get("aa") == value  # Now the most recently used
+	cache.put("dd", value)
+
+	assert cache.get("aa") == value
+	assert cache.get("dd") == value
+	assert cache.get("bb") is None
+	assert cache.get("cc") is None
+	assert sorted(os.path.basename(path) for path, _, _ in cache.entries()) == ["aa.json", "dd.json"]
+
+
+C_RESULT_BLOCK = "```c/result/wrapmain; includes=[\"stdio.h\"]\n{code}\n```\n"
+
+def result_entries(site):
+	return ResultCache(str(site / "cache" / "results"), 1024 * 1024).entries()
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="gcc is not installed")
+def test_c_results_are_cached(site, convert):
+	html = convert(C_RESULT_BLOCK.format(code='printf("%d", 6 * 7);'))
+	assert '<pre class="code-result-stdout">42</pre>' in html
+	assert len(result_entries(site)) == 1
+
+	# In quick mode, the results are only taken from the cache
+	assert convert(C_RESULT_BLOCK.format(code='printf("%d", 6 * 7);'), quick=True) == html
+	assert "code-result" not in convert(C_RESULT_BLOCK.format(code='printf("%d", 6 * 6);'), quick=True)
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="gcc is not installed")
+def test_c_compilation_failures_are_not_cached(site, convert):
+	html = convert(C_RESULT_BLOCK.format(code="int x = ;"))
+	assert '<pre class="code-result-stderr">' in html
+	assert "error" in html
+	assert len(result_entries(site)) == 0
@@ -0,0 +1,54 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+from plsres import config
+from plsres.config import load_yaml, configure_cache, YAMLError
+
+from conftest import REPOSITORY, make_parameters, write_file
+
+
+@pytest.fixture
+def yamlcache(site, monkeypatch):
+	monkeypatch.setattr(config, "_yaml_store", None)
+	monkeypatch.setattr(config, "_yaml_memory", {})
+
+
+def test_yaml_cache_is_created_on_first_use(yamlcache):
+	configure_cache(make_parameters(buildcache="build/"))
+	write_file("a.yml", "title: A\nitems: [1, 2]\n")
+	value = load_yaml("a.yml", attributes=True)
+	assert value.title == "A" and value["items"] == [1, 2]
+	value["items"].append(3)
+	assert load_yaml("a.yml")["items"] == [1, 2]  # A new object on every call
+	assert os.path.isdir(os.path.join("build", "yaml"))
+	assert not os.path.exists("cache")
+
+def test_default_yaml_cache(yamlcache, site, monkeypatch):
+	monkeypatch.setenv("XDG_CACHE_HOME", str(site / "usercache"))
+	assert config._yaml_store is None
+	write_file("a.yml", "title: A\n")
+	assert load_yaml("a.yml") == {"title": "A"}
+	assert config._yaml_store.directory == os.path.join(str(site / "usercache"), "plsres", "yaml")
+	assert os.path.isdir(os.path.join("usercache", "plsres", "yaml"))
+	assert not os.path.exists("cache")
+
+def test_yaml_errors(yamlcache):
+	write_file("broken.yml", "a: [1, 2\n")
+	with pytest.raises(YAMLError):
+		load_yaml("broken.yml")
+
+def test_cached_yaml_does_not_import_pyyaml(yamlcache):
+	import yaml
+	assert config.yaml_version() == yaml.__version__
+	configure_cache(make_parameters(buildcache="build/"))
+	write_file("a.yml", "title: A\n")
+	load_yaml("a.yml")
+
+	script = "import sys\nfrom plsres.config import load_yaml, configure_cache\nfrom plsres.util import Attributes\n" \
+	         "configure_cache(Attributes(buildcache='build/'))\nprint(load_yaml('a.yml'), 'yaml' in sys.modules)"
+	result = subprocess.run([sys.executable, "-c", script], capture_output=True, encoding="utf-8", check=True,
+	                        env=dict(os.environ, PYTHONPATH=REPOSITORY))
+	assert result.stdout == "{'title': 'A'} False\n"
@@ -0,0 +1,77 @@
+import os
+import json
+
+from plsres.util import Attributes
+from plsres.exdb import compile_store, open_store, store_path, LazyExerciseStore
+
+from conftest import make_parameters, write_file
+
+EXERCISE = """title: Addition
+questions:
+  - difficulty: 1
+    type: choices
+    text: "What is **1+1** ?"
+    choices:
+      - text: "2"
+        answer: "Yes"
+      - text: "3"
+        answer: "No"
+    hints:
+      - level: 1
+        text: Count
+    answer: Two
+"""
+
+
+def test_exercise_store(site):
+	parameters = make_parameters()
+	write_file("res/exercises/algo/add.yml", EXERCISE)
+	write_file("res/exercises/sub.yml", EXERCISE.replace("Addition", "Subtraction"))
+	assert compile_store(parameters) == {"algo.add", "sub"}
+
+	store = open_store(store_path(parameters))
+	assert sorted(store) == ["algo.add", "sub"]
+	assert store["algo.add"].questions[0].choices[0].answer == "Yes"
+	assert json.loads(store.raw("sub"))["title"] == "Subtraction"
+	fingerprint = store.fingerprint("sub")
+	store.close()
+
+	assert compile_store(parameters) == set()
+	write_file("res/exercises/sub.yml", EXERCISE.replace("Addition", "Other"))
+	os.remove("res/exercises/algo/add.yml")
+	assert compile_store(parameters) == {"algo.add", "sub"}
+	store = open_store(store_path(parameters))
+	assert list(store) == ["sub"] and store.fingerprint("sub") != fingerprint
+	store.close()
+
+def test_invalid_exercises_are_not_stored(site, capsys):
+	parameters = make_parameters()
+	write_file("res/exercises/valid.yml", EXERCISE)
+	write_file("res/exercises/nohints.yml", EXERCISE.replace("    hints:\n      - level: 1\n        text: Count\n", ""))
+	write_file("res/exercises/difficulty.yml", EXERCISE.replace("difficulty: 1", "difficulty: easy"))
+	assert compile_store(parameters) == {"valid"}
+	output = capsys.readouterr().out
+	assert "ERROR : Exercise nohints" in output and "missing key questions[0].hints" in output
+	assert "questions[0].difficulty must be of type int" in output
+
+def test_lazy_store(site, capsys):
+	parameters = make_parameters()
+	store = LazyExerciseStore(store_path(parameters))
+	assert "add" not in store and store.fingerprint("add") is None
+	assert "WARNING" in capsys.readouterr().out
+
+	write_file("res/exercises/add.yml", EXERCISE)
+	compile_store(parameters)
+	store = LazyExerciseStore(store_path(parameters))
+	assert store.opened is None
+	assert store["add"].title == "Addition"
+
+	write_file("res/exercises/add.yml", EXERCISE.replace("Addition", "Other"))
+	assert LazyExerciseStore(store_path(parameters))["add"].title == "Addition"  # Compiled again by the site builds only
+
+def test_exercise_in_document(site, convert):
+	write_file("res/exercises/add.yml", EXERCISE)
+	compile_store(make_parameters())
+	html = convert("{!exercise: add}\n", document=Attributes(docpath="", global_exercises=LazyExerciseStore(store_path(make_parameters()))))
+	assert "&gt; Exercice : Addition" in html
+	assert "<strong>1+1</strong>" in html
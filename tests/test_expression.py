@@ -0,0 +1,15 @@
+from plsres.expression import compile_expression, evaluate
+
+
+def test_compiled_expressions_use_the_given_namespaces():
+	compile_expression.cache_clear()
+	assert evaluate("x + y * 2", {"x": 1}, {"y": 2}) == 5
+	assert evaluate("x + y * 2", {"x": 10}, {"y": 0}) == 10
+	assert evaluate("x + y * 2", {"x": 1, "y": 100}, {"y": 3}) == 7  # The locals first
+	assert evaluate("[x for x in range(n)]", {}, {"n": 3}) == [0, 1, 2]
+	assert compile_expression.cache_info().hits == 2
+
+def test_expressions_in_documents(convert):
+	assert "<p>3.14 6</p>" in convert("//// n = 3\n\n{=round(pi, 2)} {=n * 2}\n")
+	assert "<p>3.14 8</p>" in convert("//// n = 4\n\n{=round(pi, 2)} {=n * 2}\n")
+	assert "<p>3</p>" in convert("//// pi = 3\n\n{=pi}\n")  # The document variables hide the globals
@@ -0,0 +1,117 @@
+import os
+import markdown
+import markdown.util
+
+from plsres.util import Attributes
+from plsres.extension import PLSResExtension, EXT_CODE_START_REGEX, compile_template
+from plsres.build import SiteCompiler, load_site_tables
+
+from conftest import make_parameters, make_extconfig, write_file
+
+CODE_BLOCKS = """# Blocks
+
+```py
+print(1)
+```
+Text between ``` and `inline` code
+```
+no language
+```
+```c
+int x;
+```
+
+```  python
+indented()
+```
+Trailing text with a ``` fence that never closes
+"""
+PAGE_TEMPLATE = ("<title>{=__title} | {=site}</title>{=color} {={=__title}}"
+                 '<ul class="{=collapsed-info}{=collapsed-other}" aria-expanded="{=expanded-info}{=expanded-other}">{=show-info}{=show-other}</ul>'
+                 "{=unknown} {=trap}<main>{=__content}</main>{=__title}")
+
+
+def make_markdown(**parameters):
+	parameters = make_parameters(**parameters)
+	extension = PLSResExtension("test.md", Attributes(docpath=""), make_extconfig(parameters), parameters, ispage=False)
+	extension.start()
+	return extension, markdown.Markdown(extensions=[extension])
+
+def stashed_code_blocks(text):
+	"""Reference extraction, searching again from the start of the text after each block"""
+	index = 0
+	while (match := EXT_CODE_START_REGEX.search(text)) is not None:
+		text = text[:match.start()] + "\n" + markdown.util.HTML_PLACEHOLDER % index + "\n" + text[match.end():]
+		index += 1
+	return text, index
+
+
+def test_code_block_extraction(site):
+	for text in (CODE_BLOCKS, CODE_BLOCKS * 20, "No code\n", "```py\nx\n```"):
+		extension, md = make_markdown()
+		lines = md.preprocessors["plsres_preprocess_code"].run(text.split("\n"))
+		expected, count = stashed_code_blocks(text)
+		assert "\n".join(lines) == expected
+		assert md.htmlStash.html_counter == count
+		extension.finish()
+
+def test_fragments_do_not_share_state(site):
+	extension, md = make_markdown()
+	first = extension.render_fragment("[link]: http://example.com\n\n[link] and *text*\n\n```py\nx = 1\n```")
+	assert '<a href="http://example.com">link</a>' in first
+	renderer = extension.fragmentrenderers[-1]
+
+	second = extension.render_fragment("[link] and *text*\n\n```py\nx = 1\n```")
+	assert extension.fragmentrenderers == [renderer]  # The same instance, reset
+	assert second.startswith("<p>[link] and <em>text</em></p>")
+	assert second.count('<div class="highlight">') == 1
+	fresh, _ = make_markdown()
+	assert second == fresh.render_fragment("[link] and *text*\n\n```py\nx = 1\n```")
+	extension.finish()
+	fresh.finish()
+
+def test_page_template(site):
+	parameters = make_parameters()
+	write_file("src/info/attributes.yml", "title: Informatique\nthemeColor: [0, 128, 255]\n")
+	write_file("src/info/page.md", '//// title = "Page & co"\n//// color = "red"\n//// trap = "{=__title}"\n\nSome text\n')
+	write_file("src/other/page.md", "Other\n")
+	extconfig = make_extconfig(parameters)
+	extconfig.globals = {"site": "PLSres", "color": "blue"}
+	extconfig.template = PAGE_TEMPLATE
+	load_site_tables(parameters, extconfig, [("src/info/page.md", "info.page"), ("src/other/page.md", "other.page")])
+
+	page, _, _ = SiteCompiler(parameters, extconfig).compile("src/info/page.md", "info.page")
+	assert page == ("<title>Page &amp; co | PLSres</title>red {=Page &amp; co}"
+	                '<ul class=" collapsed" aria-expanded="truefalse"> show</ul>'
+	                "{=unknown} {=__title}<main><p>Some text</p>\n"
+	                '<div class="page-links"><a class="internal-link link-category" href="/plsres/info.html">↑ Informatique</a></div>'
+	                "</main>Page &amp; co")  # The values are not filled in again
+	assert len(compile_template(PAGE_TEMPLATE)) == 2 * 14 + 1
+
+def changed_later(*paths):
+	"""Give new modification times, the file system may not tell quick changes apart"""
+	for path in paths:
+		changed_later.time += 1
+		os.utime(path, (changed_later.time, changed_later.time))
+changed_later.time = 1_000_000_000
+
+def test_collection_index(site, convert):
+	write_file("res/collections/col/attributes.yml", "title: Documents\n")
+	write_file("res/collections/col/a.pdf", "a")
+	html = convert("{!collection: col}\n")
+	assert "Documents" in html and "a.pdf" in html
+	assert convert("{!collection: col}\n") == html
+
+	write_file("res/collections/col/sub/b.pdf", "b")
+	changed_later("res/collections/col", "res/collections/col/sub")
+	html = convert("{!collection: col}\n")
+	assert "/res/collections/col/sub/b.pdf" in html
+
+	write_file("res/collections/col/licensing.yml", "files:\n  - name: a.pdf\n    author: Someone\n")
+	changed_later("res/collections/col", "res/collections/col/licensing.yml")
+	assert "Auteur\u202f: Someone" in convert("{!collection: col}\n")
+	write_file("res/collections/col/licensing.yml", "files:\n  - name: a.pdf\n    author: Someone else\n")
+	write_file("res/collections/col/attributes.yml", "title: Files\n")
+	changed_later("res/collections/col/licensing.yml", "res/collections/col/attributes.yml")
+	html = convert("{!collection: col}\n")
+	assert "Auteur\u202f: Someone else" in html and "Files" in html
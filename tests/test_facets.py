@@ -0,0 +1,33 @@
+from plsres.util import Attributes
+from plsres.facets import write_facets, FacetIndex
+
+
+def question(difficulty, type, *levels):
+	return Attributes(difficulty=difficulty, type=type, text="", answer=None, hints=[Attributes(level=level, text="") for level in levels])
+
+EXERCISES = {
+	"algo.sort": Attributes(title="Sort", course="IF2", questions=[question(1, "text", 1), question(3, "choices", 1, 2)]),
+	"algo.tree": Attributes(title="Tree", courses=["IF2", "IF3"], questions=[question(2, "text")]),
+	"maths.sum": Attributes(title="Sum", questions=[question(1, "choices", 3)]),
+}
+
+
+def test_facet_query(site):
+	write_facets("out/facets.bin", EXERCISES)
+	index = FacetIndex("out/facets.bin")
+	try:
+		assert sorted(index.values("course")) == ["IF2", "IF3"]
+		assert index.names(index.query(course="IF2")) == ["algo.sort", "algo.tree"]
+		assert index.names(index.query(course="IF2", difficulty=[1, 2])) == ["algo.sort", "algo.tree"]
+		assert index.names(index.query(course="IF2", difficulty=1, type="choices")) == ["algo.sort"]
+		assert index.names(index.query(course="IF3", difficulty=3)) == []
+		assert index.names(index.query(course="missing")) == []
+		assert index.query() == [0, 1, 2]
+
+		questions = index.query(scope="question", type="choices")
+		assert questions == [1, 3]
+		assert [index.exercise_of(questionid) for questionid in questions] == [0, 2]
+		assert index.query(scope="question", hintlevel=1) == [0, 1]
+		assert index.hintcounts == {"1": 2, "2": 1, "3": 1}
+	finally:
+		index.close()
@@ -0,0 +1,58 @@
+import re
+
+import pytest
+
+from plsres import mathrender
+from plsres.util import Attributes
+from plsres.mathrender import MathRenderer
+
+
+class FakeLatexRenderer (MathRenderer):
+	"""SVG renderer with the same glyph IDs in every output like dvisvgm, without running LaTeX"""
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.available = True
+		self.runs = []
+
+	def run_latex(self, formulas):
+		self.runs.append([latex for latex, display in formulas])
+		if any("\\broken" in latex for latex, display in formulas):
+			return None
+		return [f"<svg><defs><path id='g0-1' d='{latex}'/></defs><use xlink:href='#g0-1'/></svg>" for latex, display in formulas]
+
+@pytest.fixture
+def renderer(site, monkeypatch):
+	renderer = FakeLatexRenderer("svg", str(site / "cache" / "math"), 1024 * 1024, str(site / "temp"))
+	monkeypatch.setattr(mathrender, "_math_renderer", renderer)
+	return renderer
+
+def exercise_document(text):
+	question = Attributes(difficulty=1, type="text", text=text, hints=[], answer="$$z$$")
+	return Attributes(docpath="", global_exercises={"ex": Attributes(title="Exercise", questions=[question])})
+
+
+def test_formulas_are_rendered_in_one_batch(renderer, convert):
+	html = convert("Inline $$x$$ formula\n\n$$y$$\n\n{!exercise: ex}\n", document=exercise_document("Question $$w$$"), mathrender="svg")
+	assert len(renderer.runs) == 1 and sorted(renderer.runs[0]) == ["w", "x", "y", "z"]
+	for latex in ("x", "y", "w", "z"):
+		assert f"d='{latex}'" in html
+	assert "\\(" not in html and "\\[" not in html
+
+	convert("Again $$x$$\n\n$$y$$\n", mathrender="svg")
+	assert len(renderer.runs) == 1  # From the cache
+
+def test_svg_ids_are_unique(renderer, convert):
+	html = convert("$$x$$, $$y$$ and $$x$$ again\n", mathrender="svg")
+	ids = re.findall(r"\sid='([^']+)'", html)
+	assert len(ids) == 3 and len(set(ids)) == 3
+	for reference in re.findall(r"href='#([^']+)'", html):
+		assert reference in ids
+
+def test_failed_formulas_are_not_cached(renderer, convert):
+	html = convert("$$\\broken$$ and $$x$$\n", mathrender="svg")
+	assert "\\(\\broken\\)" in html
+	assert "d='x'" in html
+	assert renderer.runs == [["\\broken", "x"], ["\\broken"], ["x"]]
+
+	convert("$$\\broken$$ and $$x$$\n", mathrender="svg")
+	assert renderer.runs[3:] == [["\\broken"]]
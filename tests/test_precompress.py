@@ -0,0 +1,51 @@
+import os
+import gzip
+import json
+
+from plsres.bundle import write_bundle
+from plsres.precompress import precompress_output, PRECOMPRESS_MANIFEST
+
+from conftest import make_parameters, write_file
+
+PAGE = "<p>Some text that compresses well</p>\n" * 20
+
+
+def read_manifest():
+	with open(os.path.join("out", PRECOMPRESS_MANIFEST), "r", encoding="utf-8") as manifestfile:
+		return json.load(manifestfile)
+
+
+def test_precompress(site):
+	parameters = make_parameters(precompressformats=["gzip"])
+	write_file("out/page.html", PAGE)
+	write_file("out/small.html", "<p>Short</p>")
+	manifest = precompress_output(parameters, 1)
+	assert list(manifest.keys()) == ["page.html"]
+	assert manifest == read_manifest()
+	with gzip.open("out/page.html.gz", "rt", encoding="utf-8") as compressed:
+		assert compressed.read() == PAGE
+	assert not os.path.exists("out/small.html.gz")
+
+	modified = os.stat("out/page.html.gz").st_mtime_ns
+	precompress_output(parameters, 1)
+	assert os.stat("out/page.html.gz").st_mtime_ns == modified
+
+	os.remove("out/page.html")
+	assert precompress_output(parameters, 1) == {}
+	assert not os.path.exists("out/page.html.gz")
+
+def test_precompress_dropped_format(site):
+	write_file("out/page.html", PAGE)
+	precompress_output(make_parameters(precompressformats=["gzip"]), 1)
+	assert os.path.exists("out/page.html.gz")
+
+	manifest = precompress_output(make_parameters(precompressformats=[]), 1)
+	assert "gzip" not in manifest["page.html"]
+	assert not os.path.exists("out/page.html.gz")
+
+def test_precompress_skips_compressed_bundles(site):
+	write_file("out/page.html", PAGE)
+	write_bundle("out/bundle.jsonl", [("page", {"content": PAGE})], "gzip")
+	manifest = precompress_output(make_parameters(precompressformats=["gzip"]), 1)
+	assert "bundle.jsonl" not in manifest
+	assert not os.path.exists("out/bundle.jsonl.gz")
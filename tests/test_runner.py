@@ -0,0 +1,113 @@
+import os
+
+from plsres import runner
+from plsres.cache import ResultCache
+
+PYTHON_RESULT_BLOCK = "```python/result{params}\n{code}\n```\n"
+
+
+def result_entries(site):
+	return ResultCache(str(site / "cache" / "results"), 1024 * 1024).entries()
+
+
+def test_python_blocks_import_the_standard_modules(convert):
+	html = convert(PYTHON_RESULT_BLOCK.format(params="", code="import os, profile, cProfile\nprint(os.path.dirname(profile.__file__) == os.path.dirname(os.__file__))"))
+	assert '<pre class="code-result-stdout">True\n</pre>' in html
+
+def test_python_sys_exit(site, convert):
+	html = convert(PYTHON_RESULT_BLOCK.format(params="", code="import sys\nprint('before')\nsys.exit()\nprint('after')"))
+	assert '<pre class="code-result-stdout">before\n</pre>' in html
+
+	html = convert(PYTHON_RESULT_BLOCK.format(params="/exception", code="import sys\nsys.exit(3)"))
+	assert "SystemExit: 3" in html
+	assert len(result_entries(site)) == 2
+
+def test_python_timeouts_are_not_cached(site, convert, monkeypatch):
+	monkeypatch.setattr(runner, "_python_pool", None)  # Started again with the timeout of this test
+	html = convert(PYTHON_RESULT_BLOCK.format(params="/exception", code="while True:\n    pass"), pythontimeout=0.5)
+	assert "TimeoutError" in html
+	assert len(result_entries(site)) == 0
+
+def test_c_compiler_version_is_looked_up_once(site, convert):
+	runner.c_compiler_version.cache_clear()
+	html = convert("```c/result\nprintf(\"1\");\n```\n\n```c/result\nprintf(\"2\");\n```\n", quick=True)
+	assert "code-result" not in html
+	assert runner.c_compiler_version.cache_info().misses == 1
+
+def test_missing_c_compiler(site, convert, monkeypatch):
+	monkeypatch.setenv("PATH", str(site))
+	runner.c_compiler_version.cache_clear()
+	try:
+		html = convert("```c/result\nprintf(\"1\");\n```\n")
+		assert "gcc is not available" in html
+		assert len(result_entries(site)) == 0
+	finally:
+		runner.c_compiler_version.cache_clear()
+
+RENDEZVOUS = """import os, time
+open({mine!r}, "w").close()
+deadline = time.time() + 2
+while not os.path.exists({other!r}) and time.time() < deadline:
+    time.sleep(0.01)
+print("together" if os.path.exists({other!r}) else "alone")"""
+
+def test_concurrent_code_blocks(site, convert):
+	blocks = (PYTHON_RESULT_BLOCK.format(params="", code=RENDEZVOUS.format(mine=str(site / "a"), other=str(site / "b"))) + "\n" +
+	          PYTHON_RESULT_BLOCK.format(params="", code=RENDEZVOUS.format(mine=str(site / "b"), other=str(site / "a"))))
+	html = convert(blocks, codejobs=2)
+	assert html.count('<pre class="code-result-stdout">together\n</pre>') == 2
+
+	os.remove(site / "a")
+	os.remove(site / "b")
+	html = convert(blocks.replace("print(", "print('once', "), codejobs=1)  # One after the other
+	assert '<pre class="code-result-stdout">once alone\n</pre>' in html
+	assert '<pre class="code-result-stdout">once together\n</pre>' in html
+
+def test_kept_files(site, convert):
+	html = convert("""```c/keep/name="lib.h"; next=1
+int f(void) { return 5; }
+```
+
+```c/result/includes=["stdio.h"]
+#include "lib.h"
+int main(void) { printf("%d\\n", f()); return 0; }
+```
+
+```c/result/includes=["stdio.h"]
+#include "lib.h"
+int main(void) { return 0; }
+```
+""")
+	assert '<pre class="code-result-stdout">5</pre>' in html
+	assert "lib.h: No such file or directory" in html  # Only kept for the next block
+
+def test_c_binary_cache(site):
+	compiler = runner.CCompiler(str(site / "cache"), 1024 * 1024)
+	os.makedirs("sandbox")
+	code = "int main(void) { return 0; }"
+	assert compiler.compile(code, [], [], "sandbox", "a.c", "a.out") is None
+	assert len(compiler.binaries.entries()) == 1
+
+	os.remove("sandbox/a.c")
+	os.remove("sandbox/a.out")
+	assert compiler.compile(code, [], [], "sandbox", "a.c", "a.out") is None
+	assert os.path.exists("sandbox/a.out") and not os.path.exists("sandbox/a.c")  # Not compiled again
+	assert compiler.compile(code, ["-O2"], [], "sandbox", "a.c", "a.out") is None
+	assert os.path.exists("sandbox/a.c")
+	assert len(compiler.binaries.entries()) == 2
+
+def test_c_precompiled_headers(site):
+	compiler = runner.CCompiler(str(site / "cache"), 1024 * 1024)
+	header = compiler.precompiled_header(["stdio.h"], ["-lm"])
+	assert os.path.exists(header + ".gch")
+	assert compiler.precompiled_header(["stdio.h"], []) == header  # The link options do not change the header
+	modified = os.stat(header + ".gch").st_mtime_ns
+	assert compiler.precompiled_header(["stdio.h"], []) == header
+	assert os.stat(header + ".gch").st_mtime_ns == modified
+
+	other = compiler.precompiled_header(["stdlib.h", "stdio.h"], [])
+	assert other != header and os.path.exists(other + ".gch")
+	with open(other, "r", encoding="utf-8") as headerfile:
+		assert headerfile.read() == "#include <stdlib.h>\n#include <stdio.h>\n"
+	assert compiler.precompiled_header(["stdio.h"], ["-O2"]) != header
+	assert compiler.precompiled_header([], []) is None
@@ -0,0 +1,74 @@
+import os
+import json
+
+from plsres.search import SearchIndex
+
+from conftest import write_file
+from test_build import build, parameters
+
+PAGE = """//// title = "Sorting algorithms"
+
+# {=title}
+
+Bubble sort is slow.
+
+## Merge sort
+
+Merge sort splits the array.
+
+## Quick sort //// quick
+
+Quick sort uses a pivot.
+"""
+
+
+def read_json(path):
+	with open(path, "r", encoding="utf-8") as jsonfile:
+		return json.load(jsonfile)
+
+def test_site_search_index(parameters):
+	parameters.searchindex = "out/search"
+	write_file("src/algo/sort.md", PAGE)
+	build(parameters)
+
+	documents = {entry[0]: entry for entry in read_json("out/search/documents.json")}
+	docpath, title, description, sections = documents["algo.sort"]
+	assert title == "Sorting algorithms"
+	assert description.startswith("Bubble sort is slow.")
+	assert sections == [["", "Sorting algorithms"], ["", "Sorting algorithms"], ["section1", "Merge sort"], ["quick", "Quick sort"]]
+	assert documents["info.page1"][1] == "Page 1"
+	with open(os.path.join("out", "algo", "sort.html"), "r", encoding="utf-8") as outfile:
+		assert '<h2 id="section1">Merge sort</h2>' in outfile.read()
+
+def test_incremental_shards(parameters):
+	parameters.searchindex = "out/search"
+	write_file("src/algo/sort.md", PAGE)
+	build(parameters)
+	docid = {entry[0]: index for index, entry in enumerate(read_json("out/search/documents.json"))}["algo.sort"]
+	assert docid in read_json("out/search/pi.json")["pivot"][0::3]
+
+	write_file("src/algo/sort.md", PAGE.replace("a pivot", "a median"))
+	assert build(parameters) == 1
+	assert not os.path.exists("out/search/pi.json")  # No term left in the shard
+	assert docid in read_json("out/search/me.json")["median"][0::3]
+	modified = os.stat("out/search/bu.json").st_mtime_ns
+
+	write_file("src/info/2--page2.md", "# Page 2\n\nAnother text\n")
+	assert build(parameters) == 2  # With page 1 that links to it
+	assert "another" in read_json("out/search/an.json")
+	assert os.stat("out/search/bu.json").st_mtime_ns == modified  # Only the shards of the changed terms are written
+
+	os.remove("src/algo/sort.md")
+	build(parameters)
+	assert read_json("out/search/documents.json")[docid] is None
+	assert not os.path.exists("out/search/me.json")
+
+def test_update_without_data(site):
+	index = SearchIndex("out/search", "cache/search.json")
+	index.update("page", {"title": "Page", "description": None, "sections": [["", "Page", "some words"]]})
+	index.save()
+	assert "page" in index
+	index.update("page", None)
+	index.save()
+	assert "page" not in index
+	assert read_json("out/search/documents.json") == [None]
@@ -0,0 +1,71 @@
+import os
+import sys
+import urllib.request
+
+import pytest
+
+from plsres import watch
+from plsres.build import load_cache
+from plsres.watch import InotifyWatcher, PollingWatcher, serve_output, PREVIEW_RELOAD_SCRIPT
+
+from conftest import make_parameters, make_extconfig, write_file
+
+
+@pytest.mark.parametrize("watcher", [
+	pytest.param(InotifyWatcher, marks=pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")),
+	lambda directories: PollingWatcher(directories, interval=0.05)])
+def test_watcher(site, watcher):
+	write_file("src/page.md", "a")
+	watcher = watcher(["src"])
+	try:
+		write_file("src/page.md", "b")
+		assert os.path.join("src", "page.md") in watcher.wait(2)
+		assert watcher.wait(0.2) == set()
+	finally:
+		watcher.close()
+
+def test_inotify_watcher_close(site):
+	watcher = InotifyWatcher([str(site)])
+	fd = watcher.fd
+	watcher.close()
+	with pytest.raises(OSError):
+		os.fstat(fd)
+
+def test_preview_server(site):
+	write_file("out/info/page.html", "<html><body><p>Page</p></body></html>")
+	write_file("out/info/page.json", "{}")
+	server = serve_output(make_parameters(), 0)
+	root = f"http://127.0.0.1:{server.server_address[1]}"
+	try:
+		with urllib.request.urlopen(root + "/info/page.html") as response:
+			assert response.read() == b"<html><body><p>Page</p>" + PREVIEW_RELOAD_SCRIPT + b"</body></html>"
+		with urllib.request.urlopen(root + "/info/page.json") as response:
+			assert response.read() == b"{}"
+		server.build += 1
+		with urllib.request.urlopen(root + "/__plsres_build") as response:
+			assert response.read() == b"1"
+	finally:
+		server.shutdown()
+		server.server_close()
+
+class StopWatcher:
+	"""Watcher that stops the watch at once, as Ctrl+C does"""
+	closed = False
+	def __init__(self, directories):
+		pass
+	def wait(self, timeout=None):
+		raise KeyboardInterrupt()
+	def close(self):
+		StopWatcher.closed = True
+
+def test_watch_site(site, monkeypatch):
+	monkeypatch.setattr(watch, "make_watcher", StopWatcher)
+	write_file("src/info/page1.md", "{> info.page2}\n")
+	write_file("src/info/page2.md", "# Page 2\n")
+	parameters = make_parameters()
+	extconfig = make_extconfig(parameters)
+	extconfig.cache = load_cache(parameters)
+	watch.watch_site(parameters, lambda: extconfig, 1, 0)
+	assert StopWatcher.closed
+	with open("out/info/page1.html", "r", encoding="utf-8") as pagefile:
+		assert 'href="/info/page2.html"' in pagefile.read()  # Served at the root of the preview server